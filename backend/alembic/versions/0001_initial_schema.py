@@ -0,0 +1,101 @@
+"""initial schema
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from fastapi_users_db_sqlalchemy.generics import GUID
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'users',
+        sa.Column('id', GUID(), nullable=False),
+        sa.Column('email', sa.String(length=320), nullable=False),
+        sa.Column('hashed_password', sa.String(length=1024), nullable=False),
+        sa.Column('is_active', sa.Boolean(), nullable=False),
+        sa.Column('is_superuser', sa.Boolean(), nullable=False),
+        sa.Column('is_verified', sa.Boolean(), nullable=False),
+        sa.Column('first_name', sa.String(length=50), nullable=True),
+        sa.Column('last_name', sa.String(length=50), nullable=True),
+        sa.Column('department', sa.String(length=100), nullable=True),
+        sa.Column('is_admin', sa.Boolean(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_users_email', 'users', ['email'], unique=True)
+
+    op.create_table(
+        'conferences',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('room_number', sa.String(length=20), nullable=False),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('max_participants', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('room_number')
+    )
+
+    op.create_table(
+        'park_orbits',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('orbit_number', sa.String(length=20), nullable=False),
+        sa.Column('is_occupied', sa.Boolean(), nullable=True),
+        sa.Column('occupied_by_call_uuid', sa.String(length=100), nullable=True),
+        sa.Column('parked_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('orbit_number')
+    )
+
+    op.create_table(
+        'extensions',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('extension_number', sa.String(length=20), nullable=False),
+        sa.Column('display_name', sa.String(length=100), nullable=True),
+        sa.Column('user_id', sa.String(length=36), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('extension_number')
+    )
+
+    op.create_table(
+        'calls',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('uuid', sa.String(length=100), nullable=False),
+        sa.Column('direction', sa.String(length=20), nullable=True),
+        sa.Column('caller_id_number', sa.String(length=50), nullable=True),
+        sa.Column('caller_id_name', sa.String(length=100), nullable=True),
+        sa.Column('destination_number', sa.String(length=50), nullable=True),
+        sa.Column('extension_id', sa.String(length=36), nullable=True),
+        sa.Column('state', sa.String(length=50), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('answered_at', sa.DateTime(), nullable=True),
+        sa.Column('ended_at', sa.DateTime(), nullable=True),
+        sa.Column('park_orbit', sa.String(length=20), nullable=True),
+        sa.Column('conference_id', sa.String(length=36), nullable=True),
+        sa.Column('call_metadata', sa.JSON(), nullable=True),
+        sa.ForeignKeyConstraint(['conference_id'], ['conferences.id']),
+        sa.ForeignKeyConstraint(['extension_id'], ['extensions.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('uuid')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('calls')
+    op.drop_table('extensions')
+    op.drop_table('park_orbits')
+    op.drop_table('conferences')
+    op.drop_index('ix_users_email', table_name='users')
+    op.drop_table('users')
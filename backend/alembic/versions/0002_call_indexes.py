@@ -0,0 +1,57 @@
+"""indexes for the hot call queries
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 09:30:00.000000
+
+Each index matches a query shape the application actually runs:
+
+- ix_calls_created_at_id: history pages ordered and keyed on (created_at, id)
+- ix_calls_extension_created: history filtered by extension
+- ix_calls_state_created: history filtered by state
+- ix_calls_caller_created / ix_calls_destination_created: history filtered
+  by number (the OR of the two is answered with both indexes)
+- ix_calls_live: partial index over calls that have not ENDED, which stays
+  small however much history the table holds
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+LIVE_CALLS = sa.text("state <> 'ENDED'")
+
+
+def upgrade() -> None:
+    # A database the app created itself (create_all at startup) and then
+    # stamped 0001 has these indexes only if it was created after they were
+    # added to the model; create whichever are missing
+    existing = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('calls')}
+    indexes = [
+        ('ix_calls_created_at_id', ['created_at', 'id'], {}),
+        ('ix_calls_extension_created', ['extension_id', 'created_at', 'id'], {}),
+        ('ix_calls_state_created', ['state', 'created_at'], {}),
+        ('ix_calls_caller_created', ['caller_id_number', 'created_at'], {}),
+        ('ix_calls_destination_created', ['destination_number', 'created_at'], {}),
+        ('ix_calls_live', ['state', 'extension_id'],
+         dict(postgresql_where=LIVE_CALLS, sqlite_where=LIVE_CALLS)),
+    ]
+    for name, columns, options in indexes:
+        if name not in existing:
+            op.create_index(name, 'calls', columns, **options)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_calls_live', table_name='calls')
+    op.drop_index('ix_calls_destination_created', table_name='calls')
+    op.drop_index('ix_calls_caller_created', table_name='calls')
+    op.drop_index('ix_calls_state_created', table_name='calls')
+    op.drop_index('ix_calls_extension_created', table_name='calls')
+    op.drop_index('ix_calls_created_at_id', table_name='calls')
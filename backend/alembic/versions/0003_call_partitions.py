@@ -0,0 +1,142 @@
+"""calls archive table and optional monthly partitioning of calls
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 11:00:00.000000
+
+calls_archive receives ENDED calls moved out by the retention job
+(CALL_RETENTION_POLICY=archive) and is created on every database.
+
+With CALL_PARTITIONING=true on PostgreSQL, calls is also rebuilt as a table
+partitioned by month on created_at:
+
+- one partition per month from the oldest stored call up to
+  CALL_PARTITIONS_AHEAD months ahead, named calls_yYYYYmMM, plus
+  calls_default for anything outside them
+- created_at becomes NOT NULL, and the primary key and the uuid unique
+  constraint include it (PostgreSQL requires the partition key in both)
+- the indexes from 0002 are created on the parent, so every partition gets
+  its own copy
+
+The retention job keeps creating partitions ahead of time and can detach or
+drop old ones (CALL_RETENTION_POLICY=detach / drop). SQLite has no
+partitioning and only gets calls_archive.
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+from app.config import settings
+from app.services.call_retention import add_months, month_start, partition_ddl
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+LIVE_CALLS = sa.text("state <> 'ENDED'")
+
+
+def upgrade() -> None:
+    # A database the app created itself (create_all at startup) and then
+    # stamped already has calls_archive
+    if not sa.inspect(op.get_bind()).has_table('calls_archive'):
+        create_archive()
+
+    if op.get_bind().dialect.name == 'postgresql' and settings.call_partitioning:
+        partition_calls()
+
+
+def create_archive() -> None:
+    op.create_table(
+        'calls_archive',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('uuid', sa.String(length=100), nullable=False),
+        sa.Column('direction', sa.String(length=20), nullable=True),
+        sa.Column('caller_id_number', sa.String(length=50), nullable=True),
+        sa.Column('caller_id_name', sa.String(length=100), nullable=True),
+        sa.Column('destination_number', sa.String(length=50), nullable=True),
+        sa.Column('extension_id', sa.String(length=36), nullable=True),
+        sa.Column('state', sa.String(length=50), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('answered_at', sa.DateTime(), nullable=True),
+        sa.Column('ended_at', sa.DateTime(), nullable=True),
+        sa.Column('park_orbit', sa.String(length=20), nullable=True),
+        sa.Column('conference_id', sa.String(length=36), nullable=True),
+        sa.Column('call_metadata', sa.JSON(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_calls_archive_created_at_id', 'calls_archive', ['created_at', 'id'])
+    op.create_index('ix_calls_archive_uuid', 'calls_archive', ['uuid'])
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql' and is_partitioned():
+        unpartition_calls()
+
+    op.drop_index('ix_calls_archive_uuid', table_name='calls_archive')
+    op.drop_index('ix_calls_archive_created_at_id', table_name='calls_archive')
+    op.drop_table('calls_archive')
+
+
+def is_partitioned() -> bool:
+    return bool(op.get_bind().execute(sa.text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('calls'))"
+    )).scalar())
+
+
+def partition_calls() -> None:
+    op.execute("ALTER TABLE calls RENAME TO calls_unpartitioned")
+    op.execute("UPDATE calls_unpartitioned SET created_at = now() WHERE created_at IS NULL")
+    op.execute(
+        "CREATE TABLE calls (LIKE calls_unpartitioned INCLUDING DEFAULTS) "
+        "PARTITION BY RANGE (created_at)"
+    )
+    op.execute("ALTER TABLE calls ALTER COLUMN created_at SET NOT NULL")
+
+    oldest = op.get_bind().execute(sa.text("SELECT min(created_at) FROM calls_unpartitioned")).scalar()
+    month = month_start(oldest or datetime.utcnow())
+    last = add_months(month_start(datetime.utcnow()), settings.call_partitions_ahead)
+    while month <= last:
+        op.execute(partition_ddl(month))
+        month = add_months(month, 1)
+    op.execute("CREATE TABLE calls_default PARTITION OF calls DEFAULT")
+
+    op.execute("INSERT INTO calls SELECT * FROM calls_unpartitioned")
+    # Dropping the old table frees its constraint and index names for the new one
+    op.execute("DROP TABLE calls_unpartitioned")
+
+    op.create_primary_key('calls_pkey', 'calls', ['id', 'created_at'])
+    op.create_unique_constraint('calls_uuid_key', 'calls', ['uuid', 'created_at'])
+    op.create_foreign_key('calls_extension_id_fkey', 'calls', 'extensions', ['extension_id'], ['id'])
+    op.create_foreign_key('calls_conference_id_fkey', 'calls', 'conferences', ['conference_id'], ['id'])
+    create_call_indexes()
+
+
+def unpartition_calls() -> None:
+    op.execute("ALTER TABLE calls RENAME TO calls_partitioned")
+    op.execute("CREATE TABLE calls (LIKE calls_partitioned INCLUDING DEFAULTS)")
+    op.execute("ALTER TABLE calls ALTER COLUMN created_at DROP NOT NULL")
+    op.execute("INSERT INTO calls SELECT * FROM calls_partitioned")
+    # Drops the partitions with it
+    op.execute("DROP TABLE calls_partitioned")
+
+    op.create_primary_key('calls_pkey', 'calls', ['id'])
+    op.create_unique_constraint('calls_uuid_key', 'calls', ['uuid'])
+    op.create_foreign_key('calls_extension_id_fkey', 'calls', 'extensions', ['extension_id'], ['id'])
+    op.create_foreign_key('calls_conference_id_fkey', 'calls', 'conferences', ['conference_id'], ['id'])
+    create_call_indexes()
+
+
+def create_call_indexes() -> None:
+    """The indexes of revision 0002, recreated on the rebuilt calls table"""
+    op.create_index('ix_calls_created_at_id', 'calls', ['created_at', 'id'])
+    op.create_index('ix_calls_extension_created', 'calls', ['extension_id', 'created_at', 'id'])
+    op.create_index('ix_calls_state_created', 'calls', ['state', 'created_at'])
+    op.create_index('ix_calls_caller_created', 'calls', ['caller_id_number', 'created_at'])
+    op.create_index('ix_calls_destination_created', 'calls', ['destination_number', 'created_at'])
+    op.create_index('ix_calls_live', 'calls', ['state', 'extension_id'], postgresql_where=LIVE_CALLS)
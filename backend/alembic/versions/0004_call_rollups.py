@@ -0,0 +1,44 @@
+"""per-extension, per-hour call rollups
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 13:00:00.000000
+
+call_rollups is filled incrementally by CallManager as calls are answered
+and end; GET /api/calls/stats reads only this table. Calls stored before this
+revision are not backfilled.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Already there on a database the app created itself and then stamped
+    if sa.inspect(op.get_bind()).has_table('call_rollups'):
+        return
+    op.create_table(
+        'call_rollups',
+        sa.Column('extension_id', sa.String(length=36), nullable=False),
+        sa.Column('bucket', sa.DateTime(), nullable=False),
+        sa.Column('calls', sa.Integer(), nullable=False),
+        sa.Column('answered', sa.Integer(), nullable=False),
+        sa.Column('missed', sa.Integer(), nullable=False),
+        sa.Column('ring_seconds', sa.Float(), nullable=False),
+        sa.Column('talk_seconds', sa.Float(), nullable=False),
+        sa.Column('max_concurrent', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('extension_id', 'bucket')
+    )
+    op.create_index('ix_call_rollups_bucket', 'call_rollups', ['bucket'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_call_rollups_bucket', table_name='call_rollups')
+    op.drop_table('call_rollups')
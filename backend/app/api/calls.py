@@ -1,48 +1,269 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+import base64
+import json
+import logging
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import FileResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from typing import List
+from typing import List, Literal, Optional, Tuple
 
 from app.database import get_async_session
 from app.models.call import Call
 from app.models.user import User
-from app.schemas.call import CallRead, CallTransferRequest, CallParkRequest, CallHangupRequest
+from app.schemas.call import (
+    ActiveCallRead, CallPage, CallStatsRead, CdrExportRead, CdrExportRequest,
+    CallTransferRequest, CallParkRequest, CallHangupRequest
+)
 from app.api.auth import current_active_user
-from app.services.esl_client import ESLClient
+from app.services.call_manager import CallManager
+from app.services.call_queries import history_query, rollup_query
+from app.services.call_store import rollup_bucket
+from app.services.cdr_export import CdrExporter, ExportJob
+from app.services.container import get_call_manager, get_cdr_exporter, get_esl_client, get_extension_index
+from app.services.esl_client import BackgroundJob, ESLClient
+from app.services.extension_index import ExtensionIndex
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Global ESL client instance (should be properly managed in production)
-esl_client = ESLClient()
+# Call history page sizes
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(call: Call) -> str:
+    """Opaque keyset cursor for the position just after call"""
+    raw = json.dumps([call.created_at.isoformat(), call.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        created_at, call_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), call_id
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
 
 
-@router.get("/active", response_model=List[CallRead])
+@router.get("/active", response_model=List[ActiveCallRead])
 async def get_active_calls(
-    session: AsyncSession = Depends(get_async_session),
+    extension: Optional[str] = None,
+    state: Optional[str] = None,
+    call_manager: CallManager = Depends(get_call_manager),
     user: User = Depends(current_active_user)
 ):
-    """Get all active calls"""
-    stmt = select(Call).where(Call.state.in_(['RINGING', 'ACTIVE', 'HELD', 'PARKED']))
-    result = await session.execute(stmt)
-    calls = result.scalars().all()
+    """Get all active calls (served from memory, not the calls table)"""
+    active_calls = call_manager.active_calls
+    if extension:
+        calls = active_calls.by_extension(extension)
+    elif state:
+        calls = active_calls.by_state(state)
+    else:
+        calls = list(active_calls)
+    if state:
+        calls = [call for call in calls if call.state == state]
     return calls
 
 
-@router.get("/", response_model=List[CallRead])
+@router.get("/active/{call_uuid}", response_model=ActiveCallRead)
+async def get_active_call(
+    call_uuid: str,
+    call_manager: CallManager = Depends(get_call_manager),
+    user: User = Depends(current_active_user)
+):
+    """Get one active call by its FreeSWITCH uuid"""
+    call = call_manager.active_calls.get(call_uuid)
+    if not call:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Call not active"
+        )
+    return call
+
+
+@router.get("/", response_model=CallPage)
 async def get_all_calls(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    extension: Optional[str] = None,
+    state: Optional[str] = None,
+    direction: Optional[str] = None,
+    number: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
     session: AsyncSession = Depends(get_async_session),
+    extension_index: ExtensionIndex = Depends(get_extension_index),
     user: User = Depends(current_active_user)
 ):
-    """Get all calls (including ended)"""
-    stmt = select(Call)
+    """Get call history (including ended), newest first, one page at a time
+
+    Pages are keyed on (created_at, id), so every page costs the same no
+    matter how deep into the history it is.
+    """
+    extension_id = None
+    if extension:
+        entry = extension_index.by_number(extension, include_inactive=True)
+        if not entry:
+            return CallPage(items=[])
+        extension_id = entry.id
+        
+    stmt = history_query(
+        extension_id=extension_id,
+        state=state,
+        direction=direction,
+        number=number,
+        since=since,
+        until=until,
+        after=decode_cursor(cursor) if cursor else None
+    )
+    # One extra row tells whether there is a next page
+    stmt = stmt.limit(limit + 1)
     result = await session.execute(stmt)
     calls = result.scalars().all()
-    return calls
+    
+    next_cursor = encode_cursor(calls[limit - 1]) if len(calls) > limit else None
+    return CallPage(items=calls[:limit], next_cursor=next_cursor)
+
+
+@router.get("/stats", response_model=List[CallStatsRead])
+async def get_call_stats(
+    extension: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    group_by: Literal['hour', 'extension'] = 'hour',
+    session: AsyncSession = Depends(get_async_session),
+    extension_index: ExtensionIndex = Depends(get_extension_index),
+    user: User = Depends(current_active_user)
+):
+    """Call counts, ring/talk time and peak concurrency per extension
+
+    Reads only the call_rollups table (one row per extension and hour), so
+    the cost follows the number of hours asked for, not the number of calls.
+    since is rounded down to the hour.
+    """
+    extension_id = None
+    if extension:
+        entry = extension_index.by_number(extension, include_inactive=True)
+        if not entry:
+            return []
+        extension_id = entry.id
+        
+    stmt = rollup_query(
+        extension_id=extension_id,
+        since=rollup_bucket(since) if since else None,
+        until=until,
+        per_hour=group_by == 'hour'
+    )
+    result = await session.execute(stmt)
+    
+    stats = []
+    for row in result.mappings():
+        entry = extension_index.by_id(row['extension_id'])
+        stats.append(CallStatsRead(
+            **row,
+            extension_number=entry.extension_number if entry else None
+        ))
+    return stats
+
+
+def export_read(job: ExportJob, request: Request) -> CdrExportRead:
+    export = CdrExportRead.model_validate(job)
+    if job.status == 'done':
+        export.download_url = str(request.url_for('download_cdr_export', job_id=job.id))
+    return export
+
+
+def get_export_job(job_id: str, exporter: CdrExporter = Depends(get_cdr_exporter)) -> ExportJob:
+    job = exporter.get(job_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Export not found"
+        )
+    return job
+
+
+@router.post("/exports", response_model=CdrExportRead, status_code=status.HTTP_202_ACCEPTED)
+async def start_cdr_export(
+    export_request: CdrExportRequest,
+    request: Request,
+    exporter: CdrExporter = Depends(get_cdr_exporter),
+    extension_index: ExtensionIndex = Depends(get_extension_index),
+    user: User = Depends(current_active_user)
+):
+    """Start a CDR export to CSV (or Parquet, with pyarrow installed) in the background
+
+    Poll GET /exports/{id} for progress and fetch the file from download_url.
+    """
+    extension_id = None
+    if export_request.extension:
+        entry = extension_index.by_number(export_request.extension, include_inactive=True)
+        if not entry:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Extension not found"
+            )
+        extension_id = entry.id
+        
+    try:
+        job = exporter.start(
+            export_request.format,
+            since=export_request.since,
+            until=export_request.until,
+            extension_id=extension_id
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    return export_read(job, request)
+
+
+@router.get("/exports/{job_id}", response_model=CdrExportRead)
+async def get_cdr_export(
+    request: Request,
+    job: ExportJob = Depends(get_export_job),
+    user: User = Depends(current_active_user)
+):
+    """Progress of a CDR export"""
+    return export_read(job, request)
+
+
+@router.get("/exports/{job_id}/download", name="download_cdr_export")
+async def download_cdr_export(
+    job: ExportJob = Depends(get_export_job),
+    user: User = Depends(current_active_user)
+):
+    """The finished export file"""
+    if job.status != 'done':
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Export is {job.status}"
+        )
+    media_type = 'text/csv' if job.format == 'csv' else 'application/octet-stream'
+    return FileResponse(job.path, media_type=media_type, filename=job.filename)
+
+
+async def log_job_result(job: BackgroundJob):
+    """Wait for a bgapi job queued by a REST request and log it if it fails"""
+    try:
+        result = await job
+        if result.startswith('-ERR'):
+            logger.warning(f"Job {job.job_uuid} ({job.command}) failed: {result.strip()}")
+    except Exception as e:
+        logger.warning(f"Job {job.job_uuid} ({job.command}) failed: {str(e) or type(e).__name__}")
 
 
-@router.post("/transfer")
+@router.post("/transfer", status_code=status.HTTP_202_ACCEPTED)
 async def transfer_call(
     transfer_request: CallTransferRequest,
+    esl_client: ESLClient = Depends(get_esl_client),
     user: User = Depends(current_active_user)
 ):
     """Transfer a call"""
@@ -53,12 +274,14 @@ async def transfer_call(
                 detail="ESL connection not available"
             )
         
-        result = await esl_client.transfer_call(
+        job = await esl_client.transfer_call(
             transfer_request.uuid,
-            transfer_request.destination
+            transfer_request.destination,
+            background=True
         )
+        asyncio.create_task(log_job_result(job))
         
-        return {"message": "Call transfer initiated", "result": result}
+        return {"message": "Call transfer initiated", "job_uuid": job.job_uuid}
         
     except Exception as e:
         raise HTTPException(
@@ -67,9 +290,10 @@ async def transfer_call(
         )
 
 
-@router.post("/park")
+@router.post("/park", status_code=status.HTTP_202_ACCEPTED)
 async def park_call(
     park_request: CallParkRequest,
+    esl_client: ESLClient = Depends(get_esl_client),
     user: User = Depends(current_active_user)
 ):
     """Park a call"""
@@ -80,12 +304,14 @@ async def park_call(
                 detail="ESL connection not available"
             )
         
-        result = await esl_client.park_call(
+        job = await esl_client.park_call(
             park_request.uuid,
-            park_request.orbit
+            park_request.orbit,
+            background=True
         )
+        asyncio.create_task(log_job_result(job))
         
-        return {"message": "Call park initiated", "result": result}
+        return {"message": "Call park initiated", "job_uuid": job.job_uuid}
         
     except Exception as e:
         raise HTTPException(
@@ -94,9 +320,10 @@ async def park_call(
         )
 
 
-@router.post("/hangup")
+@router.post("/hangup", status_code=status.HTTP_202_ACCEPTED)
 async def hangup_call(
     hangup_request: CallHangupRequest,
+    esl_client: ESLClient = Depends(get_esl_client),
     user: User = Depends(current_active_user)
 ):
     """Hangup a call"""
@@ -107,9 +334,10 @@ async def hangup_call(
                 detail="ESL connection not available"
             )
         
-        result = await esl_client.hangup_call(hangup_request.uuid)
+        job = await esl_client.hangup_call(hangup_request.uuid, background=True)
+        asyncio.create_task(log_job_result(job))
         
-        return {"message": "Call hangup initiated", "result": result}
+        return {"message": "Call hangup initiated", "job_uuid": job.job_uuid}
         
     except Exception as e:
         raise HTTPException(
@@ -7,20 +7,19 @@ from app.database import get_async_session
 from app.models.user import Extension, User
 from app.schemas.extension import ExtensionCreate, ExtensionRead, ExtensionUpdate
 from app.api.auth import current_active_user
+from app.services.container import get_extension_index
+from app.services.extension_index import ExtensionIndex
 
 router = APIRouter()
 
 
 @router.get("/", response_model=List[ExtensionRead])
 async def get_extensions(
-    session: AsyncSession = Depends(get_async_session),
+    extension_index: ExtensionIndex = Depends(get_extension_index),
     user: User = Depends(current_active_user)
 ):
     """Get all extensions"""
-    stmt = select(Extension).where(Extension.is_active == True)
-    result = await session.execute(stmt)
-    extensions = result.scalars().all()
-    return extensions
+    return extension_index.active()
 
 
 @router.get("/{extension_id}", response_model=ExtensionRead)
@@ -47,6 +46,7 @@ async def get_extension(
 async def create_extension(
     extension_data: ExtensionCreate,
     session: AsyncSession = Depends(get_async_session),
+    extension_index: ExtensionIndex = Depends(get_extension_index),
     user: User = Depends(current_active_user)
 ):
     """Create new extension"""
@@ -65,6 +65,7 @@ async def create_extension(
     session.add(extension)
     await session.commit()
     await session.refresh(extension)
+    await extension_index.refresh(extension.id)
     
     return extension
 
@@ -74,6 +75,7 @@ async def update_extension(
     extension_id: str,
     extension_data: ExtensionUpdate,
     session: AsyncSession = Depends(get_async_session),
+    extension_index: ExtensionIndex = Depends(get_extension_index),
     user: User = Depends(current_active_user)
 ):
     """Update extension"""
@@ -94,6 +96,7 @@ async def update_extension(
     
     await session.commit()
     await session.refresh(extension)
+    await extension_index.refresh(extension.id)
     
     return extension
 
@@ -102,6 +105,7 @@ async def update_extension(
 async def delete_extension(
     extension_id: str,
     session: AsyncSession = Depends(get_async_session),
+    extension_index: ExtensionIndex = Depends(get_extension_index),
     user: User = Depends(current_active_user)
 ):
     """Delete extension (soft delete)"""
@@ -117,5 +121,6 @@ async def delete_extension(
     
     extension.is_active = False
     await session.commit()
+    await extension_index.refresh(extension.id)
     
     return {"message": "Extension deleted successfully"}
\ No newline at end of file
@@ -1,30 +1,33 @@
-import json
+import asyncio
 import logging
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from app.services.websocket_manager import WebSocketManager
-from app.services.call_manager import CallManager
-from app.services.esl_client import ESLClient
+from app.services.esl_client import BackgroundJob
+from app.services.container import websocket_manager, esl_client, call_manager
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Global instances (should be properly managed in production)
-websocket_manager = WebSocketManager()
-esl_client = ESLClient()
-call_manager = CallManager(websocket_manager)
-
 
 @router.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket endpoint for real-time communication"""
-    await websocket_manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, encoding: str = 'json'):
+    """WebSocket endpoint for real-time communication
+
+    ?encoding=msgpack switches both directions to MessagePack binary frames.
+    """
+    if encoding not in websocket_manager.encodings:
+        # Refuse the handshake rather than talk a format the client cannot read
+        await websocket.close(code=1003)
+        return
+    await websocket_manager.connect(websocket, encoding=encoding)
     
     try:
         while True:
-            # Receive message from client
-            data = await websocket.receive_text()
-            message = json.loads(data)
+            # Receive message from client, as text or binary per its encoding
+            received = await websocket.receive()
+            if received['type'] == 'websocket.disconnect':
+                raise WebSocketDisconnect(received.get('code', 1000))
+            message = websocket_manager.decode(received)
             
             # Handle different message types
             await handle_websocket_message(message, websocket)
@@ -45,78 +48,107 @@ async def handle_websocket_message(message: dict, websocket: WebSocket):
     try:
         if message_type == 'transfer_call':
             if esl_client.connected:
-                result = await esl_client.transfer_call(
+                job = await esl_client.transfer_call(
                     data.get('uuid'),
-                    data.get('destination')
+                    data.get('destination'),
+                    background=True
                 )
-                await websocket.send_text(json.dumps({
-                    'type': 'transfer_result',
-                    'data': {'success': True, 'result': result}
-                }))
+                await report_job(websocket, job, 'transfer_result')
             else:
-                await websocket.send_text(json.dumps({
+                await websocket_manager.send(websocket, {
                     'type': 'error',
                     'data': {'message': 'ESL connection not available'}
-                }))
+                })
                 
         elif message_type == 'park_call':
             if esl_client.connected:
-                result = await esl_client.park_call(
+                job = await esl_client.park_call(
                     data.get('uuid'),
-                    data.get('orbit')
+                    data.get('orbit'),
+                    background=True
                 )
-                await websocket.send_text(json.dumps({
-                    'type': 'park_result',
-                    'data': {'success': True, 'result': result}
-                }))
+                await report_job(websocket, job, 'park_result')
             else:
-                await websocket.send_text(json.dumps({
+                await websocket_manager.send(websocket, {
                     'type': 'error',
                     'data': {'message': 'ESL connection not available'}
-                }))
+                })
                 
         elif message_type == 'hangup_call':
             if esl_client.connected:
-                result = await esl_client.hangup_call(data.get('uuid'))
-                await websocket.send_text(json.dumps({
-                    'type': 'hangup_result',
-                    'data': {'success': True, 'result': result}
-                }))
+                job = await esl_client.hangup_call(data.get('uuid'), background=True)
+                await report_job(websocket, job, 'hangup_result')
             else:
-                await websocket.send_text(json.dumps({
+                await websocket_manager.send(websocket, {
                     'type': 'error',
                     'data': {'message': 'ESL connection not available'}
-                }))
+                })
+                
+        elif message_type == 'subscribe':
+            try:
+                topics = websocket_manager.subscribe(websocket, data.get('topics') or [])
+            except ValueError as e:
+                await websocket_manager.send(websocket, {'type': 'error', 'data': {'message': str(e)}})
+            else:
+                await websocket_manager.send(websocket, {
+                    'type': 'subscribed',
+                    'data': {'topics': sorted(topics)}
+                })
                 
         elif message_type == 'get_active_calls':
-            active_calls = await call_manager.get_active_calls()
-            await websocket.send_text(json.dumps({
-                'type': 'active_calls',
-                'data': active_calls
-            }))
+            topics = websocket_manager.subscriptions(websocket)
+            await websocket_manager.send(websocket, call_manager.snapshot_message(topics))
+            
+        elif message_type == 'resume':
+            # Replay what the client missed, or fall back to a snapshot when
+            # the gap is older than the history (or from a previous run)
+            topics = websocket_manager.subscriptions(websocket)
+            events = call_manager.changes_since(data.get('epoch'), data.get('last_seq'), topics)
+            if events is None:
+                await websocket_manager.send(websocket, call_manager.snapshot_message(topics))
+            else:
+                await websocket_manager.send(websocket, {
+                    'type': 'resumed',
+                    'data': {'events': events},
+                    'seq': call_manager.seq,
+                    'epoch': call_manager.epoch
+                })
             
         else:
-            await websocket.send_text(json.dumps({
+            await websocket_manager.send(websocket, {
                 'type': 'error',
                 'data': {'message': f'Unknown message type: {message_type}'}
-            }))
+            })
             
     except Exception as e:
         logger.error(f"Error handling WebSocket message: {e}")
-        await websocket.send_text(json.dumps({
+        await websocket_manager.send(websocket, {
             'type': 'error',
             'data': {'message': str(e)}
-        }))
-
+        })
 
-# Function to get the global instances (for dependency injection)
-def get_websocket_manager() -> WebSocketManager:
-    return websocket_manager
 
+async def report_job(websocket: WebSocket, job: BackgroundJob, result_type: str):
+    """Acknowledge a queued bgapi job now and push its result when it completes"""
+    await websocket_manager.send(websocket, {
+        'type': 'job_queued',
+        'data': {'job_uuid': job.job_uuid, 'result_type': result_type}
+    })
+    asyncio.create_task(_push_job_result(websocket, job, result_type))
 
-def get_call_manager() -> CallManager:
-    return call_manager
 
-
-def get_esl_client() -> ESLClient:
-    return esl_client
\ No newline at end of file
+async def _push_job_result(websocket: WebSocket, job: BackgroundJob, result_type: str):
+    """Wait for a bgapi job and send its outcome to the client that requested it"""
+    try:
+        result = await job
+        if result.startswith('-ERR'):
+            payload = {'success': False, 'job_uuid': job.job_uuid, 'error': result.strip()}
+        else:
+            payload = {'success': True, 'job_uuid': job.job_uuid, 'result': result}
+    except Exception as e:
+        payload = {'success': False, 'job_uuid': job.job_uuid, 'error': str(e) or type(e).__name__}
+        
+    try:
+        await websocket_manager.send(websocket, {'type': result_type, 'data': payload})
+    except Exception as e:
+        logger.warning(f"Could not deliver {result_type} for job {job.job_uuid}: {e}")
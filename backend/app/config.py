@@ -1,10 +1,28 @@
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import List, Optional
 
 
 class Settings(BaseSettings):
     # Database
     database_url: str = "sqlite+aiosqlite:///./cti_dev.db"
+    # Call rows are written behind the event stream, batched every N ms or M rows
+    call_flush_interval_ms: int = 200
+    call_flush_batch_size: int = 500
+    # Monthly partitions of calls on PostgreSQL, set up by alembic revision 0003;
+    # the retention job keeps CALL_PARTITIONS_AHEAD future months created
+    call_partitioning: bool = False
+    call_partitions_ahead: int = 2
+    # What happens to calls older than CALL_RETENTION_MONTHS: "none", "archive"
+    # (ENDED rows move to calls_archive), "detach" or "drop" (whole partitions,
+    # partitioned PostgreSQL only; archive elsewhere)
+    call_retention_policy: str = "none"
+    call_retention_months: int = 12
+    call_retention_interval: float = 3600.0
+    call_archive_batch_size: int = 1000
+    # CDR export files, rows fetched per chunk and exports allowed to run at once
+    cdr_export_dir: str = "./exports"
+    cdr_export_chunk_size: int = 5000
+    cdr_export_max_running: int = 1
     
     # JWT
     secret_key: str = "your-super-secret-jwt-key-here"
@@ -15,6 +33,32 @@ class Settings(BaseSettings):
     freeswitch_esl_password: str = "ClueCon"
     ssh_username: str = "freeswitch"
     ssh_private_key_path: str = "/path/to/ssh/key"
+    # How ESL traffic reaches FreeSWITCH: "tunnel" (local SSH port forward),
+    # "channel" (in-process SSH channel) or "direct" (plain TCP, no SSH)
+    esl_transport: str = "tunnel"
+    # Append every frame read on the event connection to this file for replay
+    esl_capture_path: Optional[str] = None
+    # Read size per recv() in the tunnel forwarder; up to 4x this is buffered per direction
+    ssh_tunnel_buffer_size: int = 262144
+    # ESL filter rules as "Header value", e.g. "variable_domain_name pbx.example.com"
+    # or "Unique-ID /^abc/" for a regex match
+    freeswitch_event_filters: List[str] = []
+    # Command-only ESL connections used for call-control next to the event connection
+    esl_command_pool_size: int = 2
+    esl_pool_health_interval: float = 15.0
+    # Event handler workers (sharded by call Unique-ID) and total queue capacity
+    esl_event_workers: int = 4
+    esl_event_queue_size: int = 1000
+    # Reconnect backoff bounds in seconds
+    esl_reconnect_initial_delay: float = 1.0
+    esl_reconnect_max_delay: float = 60.0
+    
+    # WebSocket clients that take longer than this to accept a frame are dropped
+    ws_send_timeout: float = 5.0
+    # Messages queued per client beyond its coalesced call updates before it is dropped
+    ws_client_queue_size: int = 256
+    # Recent call events kept so reconnecting clients can resume instead of re-snapshotting
+    ws_resume_buffer_size: int = 10000
     
     # Application
     debug: bool = True
@@ -1,4 +1,3 @@
-import asyncio
 import logging
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
@@ -9,9 +8,11 @@ from app.database import create_db_and_tables
 from app.api.auth import auth_backend, fastapi_users
 from app.api import extensions, calls, websocket
 from app.schemas.user import UserCreate, UserRead, UserUpdate
-from app.services.esl_client import ESLClient
 from app.services.call_manager import CallManager
-from app.api.websocket import get_websocket_manager, get_call_manager, get_esl_client
+from app.services.container import (
+    get_websocket_manager, get_call_manager, get_esl_client, get_extension_index, get_call_retention,
+    get_cdr_exporter
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -27,20 +28,28 @@ async def lifespan(app: FastAPI):
     # Create database tables
     await create_db_and_tables()
     
+    # Call attribution and GET /api/extensions/ are served from memory
+    await get_extension_index().load()
+    
     # Initialize ESL connection and event handlers
     esl_client = get_esl_client()
     call_manager = get_call_manager()
     
     # Register event handlers
-    esl_client.register_event_handler('CHANNEL_CREATE', call_manager.handle_call_event)
-    esl_client.register_event_handler('CHANNEL_ANSWER', call_manager.handle_call_event)
-    esl_client.register_event_handler('CHANNEL_HANGUP', call_manager.handle_call_event)
-    esl_client.register_event_handler('CHANNEL_PARK', call_manager.handle_call_event)
-    esl_client.register_event_handler('CONFERENCE_MEMBER_ADD', call_manager.handle_call_event)
-    esl_client.register_event_handler('CONFERENCE_MEMBER_DEL', call_manager.handle_call_event)
+    for event_type in call_manager.handled_events:
+        esl_client.register_event_handler(event_type, call_manager.handle_call_event)
+    
+    # Resync call state from FreeSWITCH after every (re)connect
+    esl_client.register_connect_handler(call_manager.resync)
+    
+    # Flush call rows to the DB in batches behind the event stream
+    call_manager.call_store.start()
     
-    # Connect to FreeSWITCH ESL (in background task)
-    asyncio.create_task(connect_esl_with_retry(esl_client))
+    # Move or detach old call history (and create upcoming partitions) in the background
+    get_call_retention().start()
+    
+    # Keep FreeSWITCH ESL connected (in background task)
+    esl_client.start()
     
     logger.info("Application startup complete")
     
@@ -48,26 +57,15 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     logger.info("Shutting down application...")
+    await get_call_retention().stop()
+    await get_cdr_exporter().stop()
     if esl_client:
         await esl_client.disconnect()
+    # Drain call writes still waiting for a flush
+    await call_manager.call_store.stop()
     logger.info("Application shutdown complete")
 
 
-async def connect_esl_with_retry(esl_client: ESLClient, max_retries: int = 5):
-    """Connect to ESL with retry logic"""
-    for attempt in range(max_retries):
-        try:
-            await esl_client.connect()
-            logger.info("ESL connection established successfully")
-            return
-        except Exception as e:
-            logger.error(f"ESL connection attempt {attempt + 1} failed: {e}")
-            if attempt < max_retries - 1:
-                await asyncio.sleep(5)  # Wait 5 seconds before retry
-    
-    logger.error("Failed to establish ESL connection after all retries")
-
-
 # Create FastAPI app
 app = FastAPI(
     title="FreeSWITCH CTI API",
@@ -138,9 +136,19 @@ async def root():
 async def health_check():
     """Health check endpoint"""
     esl_client = get_esl_client()
+    call_store = get_call_manager().call_store
     return {
         "status": "healthy",
-        "esl_connected": esl_client.connected if esl_client else False
+        "esl_connected": esl_client.connected if esl_client else False,
+        "event_queue": esl_client.event_queue.stats() if esl_client else None,
+        "ssh_tunnel": esl_client.ssh_tunnel.stats.as_dict() if esl_client and esl_client.ssh_tunnel else None,
+        "websockets": get_websocket_manager().stats(),
+        "call_writes": {
+            "pending": call_store.pending,
+            "flushes": call_store.flushes,
+            "rows_written": call_store.rows_written
+        },
+        "call_retention": get_call_retention().stats()
     }
 
 
@@ -150,5 +158,6 @@ if __name__ == "__main__":
         "app.main:app",
         host="0.0.0.0",
         port=8000,
-        reload=settings.debug
+        reload=settings.debug,
+        ws_per_message_deflate=True
     )
\ No newline at end of file
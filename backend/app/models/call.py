@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, Boolean, Integer, ForeignKey, Text, JSON
+from sqlalchemy import Column, String, DateTime, Boolean, Integer, Float, ForeignKey, Text, JSON, Index, text, func
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 from app.database import Base
@@ -27,6 +27,72 @@ class Call(Base):
     # Relationships
     extension = relationship("Extension", back_populates="calls")
     conference = relationship("Conference", back_populates="calls")
+    
+    # Keep in step with alembic/versions/0002_call_indexes.py. With
+    # CALL_PARTITIONING on PostgreSQL (revision 0003) the primary key and the
+    # uuid constraint also include created_at, the partition key
+    __table_args__ = (
+        Index("ix_calls_created_at_id", "created_at", "id"),
+        Index("ix_calls_extension_created", "extension_id", "created_at", "id"),
+        Index("ix_calls_state_created", "state", "created_at"),
+        Index("ix_calls_caller_created", "caller_id_number", "created_at"),
+        Index("ix_calls_destination_created", "destination_number", "created_at"),
+        Index(
+            "ix_calls_live", "state", "extension_id",
+            postgresql_where=text("state <> 'ENDED'"),
+            sqlite_where=text("state <> 'ENDED'")
+        ),
+    )
+
+
+class CallArchive(Base):
+    """ENDED calls moved out of calls by the retention job (call_retention_policy=archive)"""
+    __tablename__ = "calls_archive"
+    
+    id = Column(String(36), primary_key=True)
+    uuid = Column(String(100), nullable=False)
+    direction = Column(String(20))
+    caller_id_number = Column(String(50))
+    caller_id_name = Column(String(100))
+    destination_number = Column(String(50))
+    extension_id = Column(String(36))
+    state = Column(String(50))
+    created_at = Column(DateTime)
+    answered_at = Column(DateTime, nullable=True)
+    ended_at = Column(DateTime, nullable=True)
+    park_orbit = Column(String(20), nullable=True)
+    conference_id = Column(String(36), nullable=True)
+    call_metadata = Column(JSON, default=dict)
+    archived_at = Column(DateTime, server_default=func.now())
+    
+    __table_args__ = (
+        Index("ix_calls_archive_created_at_id", "created_at", "id"),
+        Index("ix_calls_archive_uuid", "uuid"),
+    )
+
+
+class CallRollup(Base):
+    """Call aggregates per extension and hour, updated incrementally by CallManager
+    
+    Calls are counted in the hour they were created in, once they end; ring
+    time runs from creation to answer (or hangup, for missed calls) and talk
+    time from answer to hangup. max_concurrent is the most answered calls the
+    extension had up at once, in the hour the answer happened.
+    """
+    __tablename__ = "call_rollups"
+    
+    extension_id = Column(String(36), primary_key=True)  # '' for calls without an extension
+    bucket = Column(DateTime, primary_key=True)  # start of the hour, UTC
+    calls = Column(Integer, nullable=False, default=0)
+    answered = Column(Integer, nullable=False, default=0)
+    missed = Column(Integer, nullable=False, default=0)
+    ring_seconds = Column(Float, nullable=False, default=0)
+    talk_seconds = Column(Float, nullable=False, default=0)
+    max_concurrent = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        Index("ix_call_rollups_bucket", "bucket"),
+    )
 
 
 class Conference(Base):
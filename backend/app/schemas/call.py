@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from datetime import datetime
 import uuid
 
@@ -47,6 +47,69 @@ class CallRead(CallBase):
         from_attributes = True
 
 
+class CallPage(BaseModel):
+    """One page of call history; pass next_cursor back as ?cursor= for the next one"""
+    items: List[CallRead]
+    next_cursor: Optional[str] = None
+
+
+class ActiveCallRead(BaseModel):
+    """A live call as tracked in memory by CallManager"""
+    uuid: str
+    direction: Optional[str] = None
+    caller_id_number: Optional[str] = None
+    caller_id_name: Optional[str] = None
+    destination_number: Optional[str] = None
+    extension_number: Optional[str] = None
+    state: str
+    created_at: datetime
+    park_orbit: Optional[str] = None
+    conference_name: Optional[str] = None
+    
+    class Config:
+        from_attributes = True
+
+
+class CallStatsRead(BaseModel):
+    """Aggregates for one extension, per hour (bucket set) or over the whole range"""
+    extension_id: Optional[str] = None
+    extension_number: Optional[str] = None
+    bucket: Optional[datetime] = None
+    calls: int
+    answered: int
+    missed: int
+    ring_seconds: float
+    talk_seconds: float
+    max_concurrent: int
+
+
+class CdrExportRequest(BaseModel):
+    """Calls created in [since, until), optionally for one extension number"""
+    format: str = 'csv'
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+    extension: Optional[str] = None
+
+
+class CdrExportRead(BaseModel):
+    """State of a CDR export; download_url is set once it is done"""
+    id: str
+    format: str
+    status: str
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+    total_rows: Optional[int] = None
+    rows_written: int
+    progress: Optional[float] = None
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    download_url: Optional[str] = None
+    
+    class Config:
+        from_attributes = True
+
+
 class CallTransferRequest(BaseModel):
     uuid: str
     destination: str
@@ -0,0 +1,144 @@
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+
+class ActiveCall:
+    """One live channel as tracked by CallManager"""
+
+    __slots__ = (
+        "uuid", "direction", "caller_id_number", "caller_id_name", "destination_number",
+        "extension_number", "state", "created_at", "park_orbit", "conference_name", "answered_at",
+    )
+
+    def __init__(self, uuid: str, direction: str, caller_id_number: Optional[str] = None,
+                 caller_id_name: Optional[str] = None, destination_number: Optional[str] = None,
+                 extension_number: Optional[str] = None, state: str = 'RINGING',
+                 created_at: Optional[datetime] = None, park_orbit: Optional[str] = None,
+                 conference_name: Optional[str] = None, answered_at: Optional[datetime] = None):
+        self.uuid = uuid
+        self.direction = direction
+        self.caller_id_number = caller_id_number
+        self.caller_id_name = caller_id_name
+        self.destination_number = destination_number
+        self.extension_number = extension_number
+        self.state = state
+        self.created_at = created_at or datetime.utcnow()
+        self.park_orbit = park_orbit
+        self.conference_name = conference_name
+        self.answered_at = answered_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        """WebSocket payload for this call"""
+        return {
+            'uuid': self.uuid,
+            'direction': self.direction,
+            'caller_id_number': self.caller_id_number,
+            'caller_id_name': self.caller_id_name,
+            'destination_number': self.destination_number,
+            'extension_number': self.extension_number,
+            'state': self.state,
+            'created_at': self.created_at.isoformat(),
+            'park_orbit': self.park_orbit,
+            'conference_name': self.conference_name
+        }
+
+    def __repr__(self) -> str:
+        return f"ActiveCall({self.uuid!r}, {self.state!r})"
+
+
+class ActiveCallRegistry:
+    """Active calls by uuid, with secondary indexes kept in step on every change
+
+    All writes must go through add(), update() and remove() so the indexes
+    by extension, state, park orbit and conference never drift.
+    """
+
+    # ActiveCall attribute -> name of the index it feeds
+    INDEXED_FIELDS = {
+        'extension_number': '_by_extension',
+        'state': '_by_state',
+        'park_orbit': '_by_orbit',
+        'conference_name': '_by_conference',
+    }
+
+    def __init__(self):
+        self._calls: Dict[str, ActiveCall] = {}
+        self._by_extension: Dict[str, Set[str]] = {}
+        self._by_state: Dict[str, Set[str]] = {}
+        self._by_orbit: Dict[str, Set[str]] = {}
+        self._by_conference: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def __contains__(self, call_uuid: str) -> bool:
+        return call_uuid in self._calls
+
+    def __iter__(self) -> Iterator[ActiveCall]:
+        return iter(list(self._calls.values()))
+
+    def get(self, call_uuid: str) -> Optional[ActiveCall]:
+        return self._calls.get(call_uuid)
+
+    def uuids(self) -> List[str]:
+        return list(self._calls)
+
+    def add(self, call: ActiveCall):
+        if call.uuid in self._calls:
+            self.remove(call.uuid)
+        self._calls[call.uuid] = call
+        for field, index in self.INDEXED_FIELDS.items():
+            self._index(getattr(self, index), getattr(call, field), call.uuid)
+
+    def update(self, call_uuid: str, **fields) -> Optional[ActiveCall]:
+        """Change fields of a call and move it between indexes as needed"""
+        call = self._calls.get(call_uuid)
+        if not call:
+            return None
+        for field, value in fields.items():
+            index = self.INDEXED_FIELDS.get(field)
+            if index:
+                old = getattr(call, field)
+                if old == value:
+                    continue
+                self._unindex(getattr(self, index), old, call_uuid)
+                self._index(getattr(self, index), value, call_uuid)
+            setattr(call, field, value)
+        return call
+
+    def remove(self, call_uuid: str) -> Optional[ActiveCall]:
+        call = self._calls.pop(call_uuid, None)
+        if call:
+            for field, index in self.INDEXED_FIELDS.items():
+                self._unindex(getattr(self, index), getattr(call, field), call_uuid)
+        return call
+
+    def by_extension(self, extension_number: str) -> List[ActiveCall]:
+        return self._lookup(self._by_extension, extension_number)
+
+    def by_state(self, state: str) -> List[ActiveCall]:
+        return self._lookup(self._by_state, state)
+
+    def in_orbit(self, park_orbit: str) -> Optional[ActiveCall]:
+        """The call parked in an orbit, if any"""
+        calls = self._lookup(self._by_orbit, park_orbit)
+        return calls[0] if calls else None
+
+    def in_conference(self, conference_name: str) -> List[ActiveCall]:
+        return self._lookup(self._by_conference, conference_name)
+
+    def _lookup(self, index: Dict[str, Set[str]], key: str) -> List[ActiveCall]:
+        return [self._calls[call_uuid] for call_uuid in index.get(key, ())]
+
+    @staticmethod
+    def _index(index: Dict[str, Set[str]], key: Optional[str], call_uuid: str):
+        if key is not None:
+            index.setdefault(key, set()).add(call_uuid)
+
+    @staticmethod
+    def _unindex(index: Dict[str, Set[str]], key: Optional[str], call_uuid: str):
+        uuids = index.get(key)
+        if uuids is not None:
+            uuids.discard(call_uuid)
+            if not uuids:
+                del index[key]
@@ -1,39 +1,76 @@
 import json
 import logging
-from typing import Dict, List, Optional
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from app.models.call import Call, Conference, ParkOrbit
-from app.models.user import Extension
-from app.services.websocket_manager import WebSocketManager
-from app.database import async_session_maker
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set, Tuple
+from app.config import settings
+from app.services.active_calls import ActiveCall, ActiveCallRegistry
+from app.services.call_store import CallWriteBehind, rollup_bucket
+from app.services.extension_index import ExtensionIndex
+from app.services.websocket_manager import ALL_TOPIC, WebSocketManager
 
 logger = logging.getLogger(__name__)
 
 
+# Subclass of the CUSTOM events mod_conference fires for member changes
+CONFERENCE_EVENT = 'conference::maniacal'
+
+# Dialplan applications that leave a channel parked
+PARK_APPLICATIONS = ('park', 'valet_park')
+
+
 class CallManager:
-    def __init__(self, websocket_manager: WebSocketManager):
+    def __init__(self, websocket_manager: WebSocketManager, call_store: Optional[CallWriteBehind] = None,
+                 extension_index: Optional[ExtensionIndex] = None):
         self.websocket_manager = websocket_manager
-        self.active_calls: Dict[str, Dict] = {}
+        self.extension_index = extension_index or ExtensionIndex()
+        # DB writes are buffered here so they stay off the event -> broadcast path
+        self.call_store = call_store or CallWriteBehind(
+            flush_interval_ms=settings.call_flush_interval_ms,
+            batch_size=settings.call_flush_batch_size
+        )
+        self.active_calls = ActiveCallRegistry()
+        # Every published change gets the next seq; epoch changes on restart so
+        # clients can tell a seq from a previous run apart
+        self.epoch = uuid.uuid4().hex
+        self.seq = 0
+        self.history: Deque[Tuple[int, Dict[str, Any], Set[str]]] = deque(maxlen=settings.ws_resume_buffer_size)
+        # uuids of calls changed by events while a resync snapshot is in flight
+        self._resync_touched: Optional[Set[str]] = None
+        self._channel_handlers = {
+            'CHANNEL_CREATE': self._handle_channel_create,
+            'CHANNEL_ANSWER': self._handle_channel_answer,
+            'CHANNEL_HANGUP': self._handle_channel_hangup,
+            'CHANNEL_PARK': self._handle_channel_park,
+        }
+        self._conference_handlers = {
+            'add-member': self._handle_conference_join,
+            'del-member': self._handle_conference_leave,
+        }
+        
+    @property
+    def handled_events(self) -> List[str]:
+        """ESL event keys this manager wants to receive"""
+        return list(self._channel_handlers) + [CONFERENCE_EVENT]
         
-    async def handle_call_event(self, event_data: str):
-        """Handle call events from FreeSWITCH"""
+    async def handle_call_event(self, event: Dict):
+        """Handle a parsed call event from FreeSWITCH"""
         try:
-            event = json.loads(event_data)
             event_name = event.get('Event-Name', '')
             
-            if event_name == 'CHANNEL_CREATE':
-                await self._handle_channel_create(event)
-            elif event_name == 'CHANNEL_ANSWER':
-                await self._handle_channel_answer(event)
-            elif event_name == 'CHANNEL_HANGUP':
-                await self._handle_channel_hangup(event)
-            elif event_name == 'CHANNEL_PARK':
-                await self._handle_channel_park(event)
-            elif event_name == 'CONFERENCE_MEMBER_ADD':
-                await self._handle_conference_join(event)
-            elif event_name == 'CONFERENCE_MEMBER_DEL':
-                await self._handle_conference_leave(event)
+            if event_name == 'CUSTOM':
+                if event.get('Event-Subclass') == CONFERENCE_EVENT:
+                    handler = self._conference_handlers.get(event.get('Action', ''))
+                else:
+                    handler = None
+            else:
+                handler = self._channel_handlers.get(event_name)
+                if handler and self._resync_touched is not None:
+                    self._resync_touched.add(event.get('Unique-ID'))
+                
+            if handler:
+                await handler(event)
                 
         except Exception as e:
             logger.error(f"Error handling call event: {e}")
@@ -41,164 +78,375 @@ class CallManager:
     async def _handle_channel_create(self, event: Dict):
         """Handle new call creation"""
         call_uuid = event.get('Unique-ID')
+        if call_uuid in self.active_calls:
+            # Already picked up by a resync snapshot
+            return
+            
         caller_id_number = event.get('Caller-Caller-ID-Number')
         caller_id_name = event.get('Caller-Caller-ID-Name')
         destination_number = event.get('Caller-Destination-Number')
         direction = event.get('Call-Direction', 'unknown')
         
-        async with async_session_maker() as session:
-            # Find extension
-            extension = None
-            if direction == 'inbound':
-                stmt = select(Extension).where(Extension.extension_number == destination_number)
-                result = await session.execute(stmt)
-                extension = result.scalar_one_or_none()
-            elif direction == 'outbound':
-                stmt = select(Extension).where(Extension.extension_number == caller_id_number)
-                result = await session.execute(stmt)
-                extension = result.scalar_one_or_none()
-                
-            # Create call record
-            call = Call(
-                uuid=call_uuid,
-                direction=direction,
-                caller_id_number=caller_id_number,
-                caller_id_name=caller_id_name,
-                destination_number=destination_number,
-                extension_id=extension.id if extension else None,
-                state='RINGING'
-            )
-            
-            session.add(call)
-            await session.commit()
-            
-            # Update active calls
-            self.active_calls[call_uuid] = {
-                'uuid': call_uuid,
-                'direction': direction,
-                'caller_id_number': caller_id_number,
-                'caller_id_name': caller_id_name,
-                'destination_number': destination_number,
-                'extension_number': extension.extension_number if extension else None,
-                'state': 'RINGING',
-                'created_at': call.created_at.isoformat()
-            }
+        # Find extension
+        extension = None
+        if direction == 'inbound':
+            extension = self.extension_index.by_number(destination_number)
+        elif direction == 'outbound':
+            extension = self.extension_index.by_number(caller_id_number)
             
-            # Broadcast to clients
-            await self.websocket_manager.broadcast({
-                'type': 'call_created',
-                'data': self.active_calls[call_uuid]
-            })
+        call = ActiveCall(
+            uuid=call_uuid,
+            direction=direction,
+            caller_id_number=caller_id_number,
+            caller_id_name=caller_id_name,
+            destination_number=destination_number,
+            extension_number=extension.extension_number if extension else None,
+            state='RINGING',
+            # Same clock as answered_at and ended_at, so ring and talk time hold
+            created_at=self._event_time(event)
+        )
+        self.active_calls.add(call)
+        self.call_store.insert({
+            'uuid': call_uuid,
+            'direction': direction,
+            'caller_id_number': caller_id_number,
+            'caller_id_name': caller_id_name,
+            'destination_number': destination_number,
+            'extension_id': extension.id if extension else None,
+            'state': 'RINGING',
+            'created_at': call.created_at
+        })
+        
+        # Broadcast to clients
+        await self._publish({
+            'type': 'call_created',
+            'data': call.to_dict()
+        }, topics=self.call_topics(call))
             
     async def _handle_channel_answer(self, event: Dict):
         """Handle call answer"""
         call_uuid = event.get('Unique-ID')
+        answered_at = self._event_time(event)
         
-        if call_uuid in self.active_calls:
-            self.active_calls[call_uuid]['state'] = 'ACTIVE'
+        call, topics = self._update_call(call_uuid, state='ACTIVE', answered_at=answered_at)
+        if call:
+            self.call_store.update(call_uuid, state='ACTIVE', answered_at=answered_at)
+            self._record_answer(call)
             
-            async with async_session_maker() as session:
-                stmt = select(Call).where(Call.uuid == call_uuid)
-                result = await session.execute(stmt)
-                call = result.scalar_one_or_none()
-                
-                if call:
-                    call.state = 'ACTIVE'
-                    call.answered_at = event.get('Event-Date-Timestamp')
-                    await session.commit()
-                    
-            await self.websocket_manager.broadcast({
+            await self._publish({
                 'type': 'call_answered',
-                'data': self.active_calls[call_uuid]
-            })
+                'data': call.to_dict()
+            }, topics=topics)
             
     async def _handle_channel_hangup(self, event: Dict):
         """Handle call hangup"""
         call_uuid = event.get('Unique-ID')
         
-        if call_uuid in self.active_calls:
-            del self.active_calls[call_uuid]
+        call = self.active_calls.remove(call_uuid)
+        if call:
+            ended_at = self._event_time(event)
+            self.call_store.update(call_uuid, state='ENDED', ended_at=ended_at)
+            self._record_hangup(call, ended_at)
             
-            async with async_session_maker() as session:
-                stmt = select(Call).where(Call.uuid == call_uuid)
-                result = await session.execute(stmt)
-                call = result.scalar_one_or_none()
-                
-                if call:
-                    call.state = 'ENDED'
-                    call.ended_at = event.get('Event-Date-Timestamp')
-                    await session.commit()
-                    
-            await self.websocket_manager.broadcast({
+            await self._publish({
                 'type': 'call_ended',
                 'data': {'uuid': call_uuid}
-            })
+            }, topics=self.call_topics(call))
             
     async def _handle_channel_park(self, event: Dict):
         """Handle call parking"""
         call_uuid = event.get('Unique-ID')
         park_orbit = event.get('variable_park_orbit')
         
-        if call_uuid in self.active_calls:
-            self.active_calls[call_uuid]['state'] = 'PARKED'
-            self.active_calls[call_uuid]['park_orbit'] = park_orbit
-            
-            async with async_session_maker() as session:
-                stmt = select(Call).where(Call.uuid == call_uuid)
-                result = await session.execute(stmt)
-                call = result.scalar_one_or_none()
-                
-                if call:
-                    call.state = 'PARKED'
-                    call.park_orbit = park_orbit
-                    await session.commit()
-                    
-                # Update park orbit status
-                stmt = select(ParkOrbit).where(ParkOrbit.orbit_number == park_orbit)
-                result = await session.execute(stmt)
-                orbit = result.scalar_one_or_none()
+        call, topics = self._update_call(call_uuid, state='PARKED', park_orbit=park_orbit)
+        if call:
+            self.call_store.update(call_uuid, state='PARKED', park_orbit=park_orbit)
+            if park_orbit:
+                self.call_store.update_orbit(
+                    park_orbit,
+                    is_occupied=True,
+                    occupied_by_call_uuid=call_uuid,
+                    parked_at=self._event_time(event)
+                )
                 
-                if orbit:
-                    orbit.is_occupied = True
-                    orbit.occupied_by_call_uuid = call_uuid
-                    await session.commit()
-                    
-            await self.websocket_manager.broadcast({
+            await self._publish({
                 'type': 'call_parked',
-                'data': self.active_calls[call_uuid]
-            })
+                'data': call.to_dict()
+            }, topics=topics)
             
     async def _handle_conference_join(self, event: Dict):
         """Handle conference member join"""
         conference_name = event.get('Conference-Name')
         member_id = event.get('Member-ID')
         caller_id_number = event.get('Caller-Caller-ID-Number')
+        _, topics = self._update_call(event.get('Unique-ID'), conference_name=conference_name)
+        topics.add(f'conference:{conference_name}')
         
-        await self.websocket_manager.broadcast({
+        await self._publish({
             'type': 'conference_member_add',
             'data': {
                 'conference_name': conference_name,
                 'member_id': member_id,
                 'caller_id_number': caller_id_number
             }
-        })
+        }, topics=topics)
         
     async def _handle_conference_leave(self, event: Dict):
         """Handle conference member leave"""
         conference_name = event.get('Conference-Name')
         member_id = event.get('Member-ID')
+        _, topics = self._update_call(event.get('Unique-ID'), conference_name=None)
+        topics.add(f'conference:{conference_name}')
         
-        await self.websocket_manager.broadcast({
+        await self._publish({
             'type': 'conference_member_del',
             'data': {
                 'conference_name': conference_name,
                 'member_id': member_id
             }
-        })
+        }, topics=topics)
+            
+    async def _publish(self, message: Dict[str, Any], topics: Set[str]):
+        """Stamp a state change with the next seq, remember it and broadcast it"""
+        self.seq += 1
+        message['seq'] = self.seq
+        self.history.append((self.seq, message, topics))
+        await self.websocket_manager.broadcast(message, topics=topics)
+        
+    def snapshot_message(self, topics: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """active_calls message for a client, stamped with the seq it is current as of"""
+        return {
+            'type': 'active_calls',
+            'data': self._active_call_payloads(topics),
+            'seq': self.seq,
+            'epoch': self.epoch
+        }
+        
+    def changes_since(self, epoch: Optional[str], last_seq: Optional[int],
+                      topics: Optional[Iterable[str]] = None) -> Optional[List[Dict[str, Any]]]:
+        """Changes after last_seq routed to topics, or None if they are no longer all held"""
+        if epoch != self.epoch or last_seq is None or last_seq > self.seq:
+            return None
+        oldest = self.history[0][0] if self.history else self.seq + 1
+        if last_seq + 1 < oldest:
+            return None
             
-    async def get_active_calls(self) -> List[Dict]:
-        """Get all active calls"""
-        return list(self.active_calls.values())
+        topics = set(topics) if topics is not None else {ALL_TOPIC}
+        everything = ALL_TOPIC in topics
+        return [
+            message for seq, message, message_topics in self.history
+            if seq > last_seq and (everything or message_topics & topics)
+        ]
+        
+    def call_topics(self, call: ActiveCall) -> Set[str]:
+        """WebSocket topics an update about call is routed to"""
+        topics = set()
+        if call.extension_number:
+            topics.add(f'extension:{call.extension_number}')
+            extension = self.extension_index.by_number(call.extension_number)
+            if extension and extension.department:
+                topics.add(f'department:{extension.department}')
+        if call.park_orbit:
+            topics.add(f'orbit:{call.park_orbit}')
+        if call.conference_name:
+            topics.add(f'conference:{call.conference_name}')
+        return topics
+        
+    def _record_answer(self, call: ActiveCall):
+        """Raise the extension's concurrency mark for the hour the call was answered in"""
+        if not call.extension_number:
+            return
+        answered = sum(1 for other in self.active_calls.by_extension(call.extension_number) if other.answered_at)
+        self.call_store.add_to_rollup(
+            self._rollup_extension_id(call), rollup_bucket(call.answered_at), max_concurrent=answered
+        )
+        
+    def _record_hangup(self, call: ActiveCall, ended_at: datetime):
+        """Count a finished call in the rollup of its extension and the hour it was created in"""
+        answered_at = call.answered_at
+        ring_end = answered_at or ended_at
+        self.call_store.add_to_rollup(
+            self._rollup_extension_id(call), rollup_bucket(call.created_at),
+            calls=1,
+            answered=1 if answered_at else 0,
+            missed=0 if answered_at else 1,
+            ring_seconds=max((ring_end - call.created_at).total_seconds(), 0),
+            talk_seconds=max((ended_at - answered_at).total_seconds(), 0) if answered_at else 0
+        )
+        
+    def _rollup_extension_id(self, call: ActiveCall) -> str:
+        extension = self.extension_index.by_number(call.extension_number, include_inactive=True)
+        return extension.id if extension else ''
+        
+    def _update_call(self, call_uuid: str, **fields) -> Tuple[Optional[ActiveCall], Set[str]]:
+        """Apply a change to an active call; topics cover where it was and where it is now"""
+        call = self.active_calls.get(call_uuid)
+        if not call:
+            return None, set()
+        topics = self.call_topics(call)
+        self.active_calls.update(call_uuid, **fields)
+        return call, topics | self.call_topics(call)
+        
+    async def resync(self, esl_client):
+        """Reconcile active_calls with FreeSWITCH after a (re)connect
+
+        One 'show channels as json' snapshot is diffed against the in-memory
+        state; only the differences are broadcast and written to the DB.
+        Events keep being handled while the snapshot is taken, so calls they
+        touched in the meantime are already newer than the snapshot and are
+        left out of the diff.
+        """
+        self._resync_touched = set()
+        try:
+            raw = await esl_client.api("show channels as json")
+            touched = self._resync_touched
+        finally:
+            self._resync_touched = None
+            
+        snapshot: Dict[str, ActiveCall] = {}
+        for row in json.loads(raw).get('rows') or []:
+            call = self._call_from_channel_row(row, self.extension_index)
+            if call.uuid not in touched:
+                snapshot[call.uuid] = call
+            
+        # Apply the diff to memory in one step, before anything else can run
+        ended = [
+            call_uuid for call_uuid in self.active_calls.uuids()
+            if call_uuid not in snapshot and call_uuid not in touched
+        ]
+        created = [call_uuid for call_uuid in snapshot if call_uuid not in self.active_calls]
+        changed = [
+            call_uuid for call_uuid, call in snapshot.items()
+            if call_uuid in self.active_calls and (
+                self.active_calls.get(call_uuid).state != call.state
+                or self.active_calls.get(call_uuid).park_orbit != call.park_orbit
+            )
+        ]
+        now = datetime.utcnow()
+        topics: Dict[str, Set[str]] = {}
+        for call_uuid in ended:
+            call = self.active_calls.remove(call_uuid)
+            topics[call_uuid] = self.call_topics(call)
+            self._record_hangup(call, now)
+        for call_uuid in created:
+            self.active_calls.add(snapshot[call_uuid])
+            topics[call_uuid] = self.call_topics(snapshot[call_uuid])
+        for call_uuid in changed:
+            _, topics[call_uuid] = self._update_call(
+                call_uuid, state=snapshot[call_uuid].state, park_orbit=snapshot[call_uuid].park_orbit,
+                answered_at=self.active_calls.get(call_uuid).answered_at or snapshot[call_uuid].answered_at
+            )
+            
+        logger.info(
+            f"Resynced {len(snapshot)} channels: {len(created)} new, "
+            f"{len(changed)} changed, {len(ended)} ended"
+        )
+        
+        if not (ended or created or changed):
+            return
+            
+        for call_uuid in ended:
+            self.call_store.update(call_uuid, state='ENDED', ended_at=now)
+        if created:
+            known = await self.call_store.existing_uuids(created)
+            for call_uuid in created:
+                call = snapshot[call_uuid]
+                if call_uuid in known:
+                    self.call_store.update(call_uuid, state=call.state, park_orbit=call.park_orbit)
+                else:
+                    extension = self.extension_index.by_number(call.extension_number)
+                    self.call_store.insert({
+                        'uuid': call_uuid,
+                        'direction': call.direction,
+                        'caller_id_number': call.caller_id_number,
+                        'caller_id_name': call.caller_id_name,
+                        'destination_number': call.destination_number,
+                        'extension_id': extension.id if extension else None,
+                        'state': call.state,
+                        'park_orbit': call.park_orbit,
+                        'created_at': call.created_at
+                    })
+        for call_uuid in changed:
+            call = snapshot[call_uuid]
+            self.call_store.update(call_uuid, state=call.state, park_orbit=call.park_orbit)
+            
+        for call_uuid in ended:
+            await self._publish(
+                {'type': 'call_ended', 'data': {'uuid': call_uuid}}, topics=topics[call_uuid]
+            )
+        for call_uuid in created:
+            await self._publish(
+                {'type': 'call_created', 'data': snapshot[call_uuid].to_dict()}, topics=topics[call_uuid]
+            )
+        for call_uuid in changed:
+            call = self.active_calls.get(call_uuid) or snapshot[call_uuid]
+            await self._publish({
+                'type': self._update_message_type(call.state),
+                'data': call.to_dict()
+            }, topics=topics[call_uuid])
+            
+    @staticmethod
+    def _call_from_channel_row(row: Dict, extension_index: ExtensionIndex) -> ActiveCall:
+        """Build an ActiveCall from a 'show channels' row"""
+        direction = row.get('direction', 'unknown')
+        caller_id_number = row.get('cid_num')
+        destination_number = row.get('dest')
+        local_number = destination_number if direction == 'inbound' else caller_id_number
+        
+        park_orbit = None
+        if row.get('application') in PARK_APPLICATIONS:
+            state = 'PARKED'
+            park_orbit = row.get('application_data') or None
+        elif row.get('callstate') in ('ACTIVE', 'HELD'):
+            state = row['callstate']
+        else:
+            state = 'RINGING'
+            
+        created_epoch = row.get('created_epoch')
+        created_at = datetime.utcfromtimestamp(int(created_epoch)) if created_epoch else datetime.utcnow()
+        # show channels has no answer time, so answered calls found by a
+        # resync count their ring time as talk time
+        answered_at = created_at if row.get('callstate') in ('ACTIVE', 'HELD') else None
+        
+        return ActiveCall(
+            uuid=row.get('uuid'),
+            direction=direction,
+            caller_id_number=caller_id_number,
+            caller_id_name=row.get('cid_name'),
+            destination_number=destination_number,
+            extension_number=local_number if extension_index.by_number(local_number) else None,
+            state=state,
+            created_at=created_at,
+            park_orbit=park_orbit,
+            answered_at=answered_at
+        )
+        
+    @staticmethod
+    def _event_time(event: Dict) -> datetime:
+        """Event-Date-Timestamp (microseconds since the epoch) as a naive UTC datetime"""
+        timestamp = event.get('Event-Date-Timestamp')
+        if timestamp:
+            return datetime.utcfromtimestamp(int(timestamp) / 1000000)
+        return datetime.utcnow()
+        
+    @staticmethod
+    def _update_message_type(state: str) -> str:
+        """WebSocket message type announcing a call's new state"""
+        if state == 'ACTIVE':
+            return 'call_answered'
+        if state == 'PARKED':
+            return 'call_parked'
+        return 'call_updated'
+        
+    async def get_active_calls(self, topics: Optional[Iterable[str]] = None) -> List[Dict]:
+        """Get all active calls, or only those routed to any of topics"""
+        return self._active_call_payloads(topics)
+        
+    def _active_call_payloads(self, topics: Optional[Iterable[str]]) -> List[Dict]:
+        if topics is None or ALL_TOPIC in topics:
+            return [call.to_dict() for call in self.active_calls]
+        topics = set(topics)
+        return [call.to_dict() for call in self.active_calls if self.call_topics(call) & topics]
         
     async def transfer_call(self, call_uuid: str, destination: str) -> bool:
         """Transfer a call (to be called by API)"""
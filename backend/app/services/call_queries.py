@@ -0,0 +1,94 @@
+"""The calls-table queries the application runs, in one place
+
+The API and the write path build their statements here, and
+app.utils.explain_check runs EXPLAIN on the same statements, so the index
+check always covers the real query shapes.
+"""
+from datetime import datetime
+from typing import Optional, Tuple
+from sqlalchemy import Select, and_, func, or_, select
+from app.models.call import Call, CallRollup
+
+
+def history_query(extension_id: Optional[str] = None, state: Optional[str] = None,
+                  direction: Optional[str] = None, number: Optional[str] = None,
+                  since: Optional[datetime] = None, until: Optional[datetime] = None,
+                  after: Optional[Tuple[datetime, str]] = None) -> Select:
+    """Call history newest first, keyed on (created_at, id); after is the cursor key"""
+    stmt = select(Call)
+    if extension_id:
+        stmt = stmt.where(Call.extension_id == extension_id)
+    if state:
+        stmt = stmt.where(Call.state == state)
+    if direction:
+        stmt = stmt.where(Call.direction == direction)
+    if number:
+        stmt = stmt.where(or_(Call.caller_id_number == number, Call.destination_number == number))
+    if since:
+        stmt = stmt.where(Call.created_at >= since)
+    if until:
+        stmt = stmt.where(Call.created_at < until)
+    if after:
+        created_at, call_id = after
+        stmt = stmt.where(or_(
+            Call.created_at < created_at,
+            and_(Call.created_at == created_at, Call.id < call_id)
+        ))
+    return stmt.order_by(Call.created_at.desc(), Call.id.desc())
+
+
+def live_calls_query() -> Select:
+    """uuids of calls the DB still considers live (served by the partial ix_calls_live)"""
+    return select(Call.uuid).where(Call.state != 'ENDED')
+
+
+def rollup_query(extension_id: Optional[str] = None, since: Optional[datetime] = None,
+                 until: Optional[datetime] = None, per_hour: bool = True) -> Select:
+    """CallRollup rows in [since, until), one per extension and hour or summed per extension"""
+    if per_hour:
+        stmt = select(
+            CallRollup.extension_id, CallRollup.bucket, CallRollup.calls, CallRollup.answered,
+            CallRollup.missed, CallRollup.ring_seconds, CallRollup.talk_seconds, CallRollup.max_concurrent
+        ).order_by(CallRollup.bucket, CallRollup.extension_id)
+    else:
+        stmt = select(
+            CallRollup.extension_id,
+            func.sum(CallRollup.calls).label('calls'),
+            func.sum(CallRollup.answered).label('answered'),
+            func.sum(CallRollup.missed).label('missed'),
+            func.sum(CallRollup.ring_seconds).label('ring_seconds'),
+            func.sum(CallRollup.talk_seconds).label('talk_seconds'),
+            func.max(CallRollup.max_concurrent).label('max_concurrent')
+        ).group_by(CallRollup.extension_id).order_by(CallRollup.extension_id)
+    if extension_id is not None:
+        stmt = stmt.where(CallRollup.extension_id == extension_id)
+    if since:
+        stmt = stmt.where(CallRollup.bucket >= since)
+    if until:
+        stmt = stmt.where(CallRollup.bucket < until)
+    return stmt
+
+
+def _export_filters(stmt: Select, since: Optional[datetime], until: Optional[datetime],
+                    extension_id: Optional[str]) -> Select:
+    if extension_id:
+        stmt = stmt.where(Call.extension_id == extension_id)
+    if since:
+        stmt = stmt.where(Call.created_at >= since)
+    if until:
+        stmt = stmt.where(Call.created_at < until)
+    return stmt
+
+
+def export_query(since: Optional[datetime] = None, until: Optional[datetime] = None,
+                 extension_id: Optional[str] = None) -> Select:
+    """Calls created in [since, until) oldest first, as plain rows (no ORM objects) for CDR export"""
+    stmt = select(*Call.__table__.columns)
+    return _export_filters(stmt, since, until, extension_id).order_by(Call.created_at, Call.id)
+
+
+def export_count_query(since: Optional[datetime] = None, until: Optional[datetime] = None,
+                       extension_id: Optional[str] = None) -> Select:
+    """Number of rows export_query will return, for progress reporting"""
+    stmt = select(func.count()).select_from(Call)
+    return _export_filters(stmt, since, until, extension_id)
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import delete, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from app.database import engine as default_engine
+from app.models.call import Call, CallArchive
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ('none', 'archive', 'detach', 'drop')
+
+# Monthly partitions are named after the month they hold: calls_y2026m10
+PARTITION_NAME = re.compile(r'^calls_y(\d{4})m(\d{2})$')
+
+
+def month_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, 1)
+
+
+def add_months(month: datetime, count: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"calls_y{month:%Y}m{month:%m}"
+
+
+def partition_ddl(month: datetime) -> str:
+    """CREATE TABLE for the partition of calls holding the given month"""
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF calls "
+        f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+    )
+
+
+async def is_partitioned(connection: AsyncConnection) -> bool:
+    """Whether calls is a partitioned table (PostgreSQL with CALL_PARTITIONING)"""
+    if connection.dialect.name != 'postgresql':
+        return False
+    result = await connection.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('calls'))"
+    ))
+    return bool(result.scalar())
+
+
+async def monthly_partitions(connection: AsyncConnection) -> List[Tuple[datetime, str]]:
+    """(month, partition name) of the monthly partitions attached to calls, oldest first"""
+    result = await connection.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass('calls')"
+    ))
+    partitions = []
+    for name in result.scalars():
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions.append((datetime(int(match.group(1)), int(match.group(2)), 1), name))
+    return sorted(partitions)
+
+
+class CallRetention:
+    """Background job that keeps the calls table to recent history
+
+    Calls created before the start of the month retention_months ago leave
+    calls according to policy:
+
+    - none: kept forever
+    - archive: ENDED rows are moved to calls_archive in batches
+    - detach: whole monthly partitions are detached and left as plain tables
+    - drop: whole monthly partitions are detached and dropped
+
+    detach and drop need calls to be partitioned (PostgreSQL with
+    CALL_PARTITIONING); elsewhere, e.g. SQLite in development, they fall back
+    to archive. On a partitioned table every run also creates the partitions
+    for the current and the next partitions_ahead months, so inserts never
+    land in the default partition.
+    """
+
+    def __init__(self, engine: AsyncEngine = default_engine, policy: str = 'none',
+                 retention_months: int = 12, partitions_ahead: int = 2,
+                 interval: float = 3600.0, batch_size: int = 1000):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown call retention policy {policy!r}, expected one of {', '.join(POLICIES)}")
+        self.engine = engine
+        self.policy = policy
+        self.retention_months = retention_months
+        self.partitions_ahead = partitions_ahead
+        self.interval = interval
+        self.batch_size = batch_size
+        self.partitioned: Optional[bool] = None
+        self._task: asyncio.Task = None
+        self.runs = 0
+        self.last_run: Optional[datetime] = None
+        self.archived = 0
+        self.detached: List[str] = []
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._retention_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'policy': self.policy,
+            'retention_months': self.retention_months,
+            'partitioned': self.partitioned,
+            'runs': self.runs,
+            'last_run': self.last_run.isoformat() if self.last_run else None,
+            'archived': self.archived,
+            'detached': self.detached
+        }
+
+    async def _retention_loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Call retention run failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self, now: Optional[datetime] = None):
+        """Create upcoming partitions and apply the policy to calls older than the cutoff"""
+        now = now or datetime.utcnow()
+        cutoff = add_months(month_start(now), -self.retention_months)
+
+        async with self.engine.connect() as connection:
+            self.partitioned = await is_partitioned(connection)
+
+        if self.partitioned:
+            await self.ensure_partitions(now)
+
+        if self.policy in ('detach', 'drop'):
+            if self.partitioned:
+                await self.detach_partitions(cutoff)
+            else:
+                await self.archive_ended(cutoff)
+        elif self.policy == 'archive':
+            await self.archive_ended(cutoff)
+
+        self.runs += 1
+        self.last_run = now
+
+    async def ensure_partitions(self, now: datetime):
+        month = month_start(now)
+        for offset in range(self.partitions_ahead + 1):
+            ddl = partition_ddl(add_months(month, offset))
+            try:
+                async with self.engine.begin() as connection:
+                    await connection.execute(text(ddl))
+            except Exception as e:
+                # Fails when calls_default already holds rows for that month
+                logger.error(f"Could not create call partition: {ddl}: {e}")
+
+    async def detach_partitions(self, cutoff: datetime) -> List[str]:
+        """Detach (or drop) the monthly partitions that end on or before cutoff"""
+        async with self.engine.connect() as connection:
+            partitions = await monthly_partitions(connection)
+
+        detached = []
+        for month, name in partitions:
+            if add_months(month, 1) > cutoff:
+                break
+            async with self.engine.begin() as connection:
+                await connection.execute(text(f"ALTER TABLE calls DETACH PARTITION {name}"))
+                if self.policy == 'drop':
+                    await connection.execute(text(f"DROP TABLE {name}"))
+            logger.info(f"{'Dropped' if self.policy == 'drop' else 'Detached'} call partition {name}")
+            detached.append(name)
+
+        self.detached.extend(detached)
+        return detached
+
+    async def archive_ended(self, cutoff: datetime) -> int:
+        """Move ENDED calls created before cutoff to calls_archive, one batch per transaction"""
+        calls = Call.__table__
+        columns = [column.name for column in calls.columns]
+        moved = 0
+        while True:
+            async with self.engine.begin() as connection:
+                result = await connection.execute(
+                    select(calls.c.id)
+                    .where(calls.c.state == 'ENDED', calls.c.created_at < cutoff)
+                    .order_by(calls.c.created_at)
+                    .limit(self.batch_size)
+                )
+                ids = result.scalars().all()
+                if not ids:
+                    break
+                await connection.execute(
+                    insert(CallArchive.__table__).from_select(
+                        columns, select(*calls.columns).where(calls.c.id.in_(ids))
+                    )
+                )
+                await connection.execute(delete(calls).where(calls.c.id.in_(ids)))
+
+            moved += len(ids)
+            self.archived += len(ids)
+            # Short transactions, and room for the call writes in between
+            await asyncio.sleep(0)
+
+        if moved:
+            logger.info(f"Archived {moved} calls created before {cutoff:%Y-%m-%d}")
+        return moved
@@ -0,0 +1,249 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Set, Tuple
+from sqlalchemy import bindparam, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import InterfaceError, OperationalError
+from app.database import async_session_maker
+from app.models.call import Call, CallRollup, ParkOrbit
+
+logger = logging.getLogger(__name__)
+
+# CallRollup columns that are summed; max_concurrent is kept as a maximum
+ROLLUP_COUNTERS = ('calls', 'answered', 'missed', 'ring_seconds', 'talk_seconds')
+
+# Errors that mean the database could not be reached rather than that a row
+# is bad; the rows are kept and written by a later flush
+UNAVAILABLE_ERRORS = (OperationalError, InterfaceError, OSError, asyncio.TimeoutError)
+
+
+def rollup_bucket(moment: datetime) -> datetime:
+    """The CallRollup bucket (start of the hour) a moment falls in"""
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+class CallWriteBehind:
+    """Write-behind buffer for call persistence
+
+    CallManager records inserts, field updates and rollup increments here
+    and carries on; the changes are coalesced per call (and per rollup
+    bucket) and written every flush_interval_ms or as soon as batch_size
+    rows are pending, as batched INSERT/UPDATE statements in a single
+    transaction. While the database is unreachable the changes stay
+    pending and are retried on the next flush.
+    """
+
+    def __init__(self, session_maker=async_session_maker,
+                 flush_interval_ms: int = 200, batch_size: int = 500):
+        self.session_maker = session_maker
+        self.flush_interval = flush_interval_ms / 1000
+        self.batch_size = batch_size
+        self._inserts: Dict[str, Dict[str, Any]] = {}
+        self._updates: Dict[str, Dict[str, Any]] = {}
+        self._orbits: Dict[str, Dict[str, Any]] = {}
+        self._rollups: Dict[Tuple[str, datetime], Dict[str, float]] = {}
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task = None
+        self._stopping = False
+        # Set while the last flush had to keep rows because the DB was unreachable
+        self._retrying = False
+        self._flush_lock = asyncio.Lock()
+        self.flushes = 0
+        self.rows_written = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._inserts) + len(self._updates) + len(self._orbits) + len(self._rollups)
+
+    def start(self):
+        if not self._task:
+            self._stopping = False
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the flusher and write out everything still pending"""
+        if self._task:
+            # Let a flush in progress finish rather than cancelling it with
+            # its batch already taken out of the buffers
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def insert(self, values: Dict[str, Any]):
+        """Queue a new call row (values must include uuid)"""
+        self._inserts[values['uuid']] = dict(values)
+        self._changed()
+
+    def update(self, call_uuid: str, **values):
+        """Queue field changes for a call, merged with anything still pending for it"""
+        if call_uuid in self._inserts:
+            self._inserts[call_uuid].update(values)
+        else:
+            self._updates.setdefault(call_uuid, {}).update(values)
+        self._changed()
+
+    def update_orbit(self, orbit_number: str, **values):
+        """Queue field changes for a park orbit"""
+        self._orbits.setdefault(orbit_number, {}).update(values)
+        self._changed()
+
+    def add_to_rollup(self, extension_id: str, bucket: datetime, max_concurrent: int = 0, **counters):
+        """Queue increments of ROLLUP_COUNTERS (and a concurrency high-water mark) for one bucket"""
+        pending = self._rollups.get((extension_id, bucket))
+        if pending is None:
+            pending = self._rollups[(extension_id, bucket)] = dict.fromkeys(ROLLUP_COUNTERS, 0)
+            pending['max_concurrent'] = 0
+        for name, value in counters.items():
+            pending[name] += value
+        pending['max_concurrent'] = max(pending['max_concurrent'], max_concurrent)
+        self._changed()
+
+    async def existing_uuids(self, call_uuids: Iterable[str]) -> Set[str]:
+        """Call uuids that are already stored or waiting to be inserted"""
+        call_uuids = list(call_uuids)
+        known = {call_uuid for call_uuid in call_uuids if call_uuid in self._inserts}
+        async with self.session_maker() as session:
+            result = await session.execute(select(Call.uuid).where(Call.uuid.in_(call_uuids)))
+            known.update(result.scalars().all())
+        return known
+
+    def _changed(self):
+        if self.pending >= self.batch_size:
+            self._wakeup.set()
+
+    async def _flush_loop(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing call writes: {e}")
+            if self._retrying and not self._stopping:
+                # A full buffer would otherwise retry a down DB back to back
+                await asyncio.sleep(self.flush_interval)
+
+    async def flush(self):
+        """Write all pending changes in one transaction"""
+        async with self._flush_lock:
+            if not self.pending:
+                return
+            inserts, self._inserts = list(self._inserts.values()), {}
+            updates, self._updates = self._updates, {}
+            orbits, self._orbits = self._orbits, {}
+            rollups, self._rollups = self._rollups, {}
+
+            written = len(inserts) + len(updates) + len(orbits) + len(rollups)
+            self._retrying = False
+            try:
+                async with self.session_maker() as session:
+                    await self._write(session, inserts, updates, orbits, rollups)
+                    await session.commit()
+            except UNAVAILABLE_ERRORS as e:
+                logger.error(f"Call flush failed ({e}), keeping {written} rows for the next flush")
+                self._requeue(inserts, updates, orbits, rollups)
+                written = 0
+            except Exception as e:
+                # One bad row must not lose the whole batch
+                logger.error(f"Batched call flush failed ({e}), retrying row by row")
+                written = await self._write_individually(inserts, updates, orbits, rollups)
+
+            self.flushes += 1
+            self.rows_written += written
+
+    async def _write(self, session, inserts: List[Dict[str, Any]],
+                     updates: Dict[str, Dict[str, Any]], orbits: Dict[str, Dict[str, Any]],
+                     rollups: Dict[Tuple[str, datetime], Dict[str, float]]):
+        for rows in self._group_by_columns(inserts):
+            await session.execute(insert(Call), rows)
+
+        # The SET clause comes from the keys of each row, so rows are
+        # grouped by the columns they change
+        calls = Call.__table__
+        stmt = update(calls).where(calls.c.uuid == bindparam('call_uuid'))
+        for rows in self._update_batches(updates, 'call_uuid'):
+            await session.execute(stmt, rows)
+
+        orbits_table = ParkOrbit.__table__
+        stmt = update(orbits_table).where(orbits_table.c.orbit_number == bindparam('orbit'))
+        for rows in self._update_batches(orbits, 'orbit'):
+            await session.execute(stmt, rows)
+
+        if rollups:
+            stmt = self._rollup_upsert(session.get_bind().dialect.name)
+            await session.execute(stmt, [
+                dict(values, extension_id=extension_id, bucket=bucket)
+                for (extension_id, bucket), values in rollups.items()
+            ])
+
+    async def _write_individually(self, inserts: List[Dict[str, Any]],
+                                  updates: Dict[str, Dict[str, Any]],
+                                  orbits: Dict[str, Dict[str, Any]],
+                                  rollups: Dict[Tuple[str, datetime], Dict[str, float]]) -> int:
+        """Write each change in its own transaction; returns how many were written"""
+        batches = [([row], {}, {}, {}) for row in inserts]
+        batches += [([], {key: values}, {}, {}) for key, values in updates.items()]
+        batches += [([], {}, {key: values}, {}) for key, values in orbits.items()]
+        batches += [([], {}, {}, {key: values}) for key, values in rollups.items()]
+        written = 0
+        for batch in batches:
+            try:
+                async with self.session_maker() as session:
+                    await self._write(session, *batch)
+                    await session.commit()
+                written += 1
+            except UNAVAILABLE_ERRORS as e:
+                logger.error(f"Keeping call write {batch} for the next flush: {e}")
+                self._requeue(*batch)
+            except Exception as e:
+                logger.error(f"Dropping call write {batch}: {e}")
+        return written
+
+    def _requeue(self, inserts: List[Dict[str, Any]], updates: Dict[str, Dict[str, Any]],
+                 orbits: Dict[str, Dict[str, Any]], rollups: Dict[Tuple[str, datetime], Dict[str, float]]):
+        """Put unwritten changes back, under anything queued for the same rows since"""
+        self._retrying = True
+        for row in inserts:
+            call_uuid = row['uuid']
+            self._inserts[call_uuid] = dict(row, **self._updates.pop(call_uuid, {}))
+        for call_uuid, values in updates.items():
+            self._updates[call_uuid] = dict(values, **self._updates.get(call_uuid, {}))
+        for orbit_number, values in orbits.items():
+            self._orbits[orbit_number] = dict(values, **self._orbits.get(orbit_number, {}))
+        for (extension_id, bucket), values in rollups.items():
+            max_concurrent = values['max_concurrent']
+            counters = {name: values[name] for name in ROLLUP_COUNTERS}
+            self.add_to_rollup(extension_id, bucket, max_concurrent=max_concurrent, **counters)
+
+    @staticmethod
+    def _rollup_upsert(dialect_name: str):
+        """INSERT that adds to the bucket's row when it already exists"""
+        rollups = CallRollup.__table__
+        if dialect_name == 'postgresql':
+            stmt, greatest = postgresql.insert(rollups), func.greatest
+        else:
+            stmt, greatest = sqlite.insert(rollups), func.max
+        values = {name: rollups.c[name] + stmt.excluded[name] for name in ROLLUP_COUNTERS}
+        values['max_concurrent'] = greatest(rollups.c.max_concurrent, stmt.excluded.max_concurrent)
+        return stmt.on_conflict_do_update(index_elements=['extension_id', 'bucket'], set_=values)
+
+    @staticmethod
+    def _group_by_columns(rows: List[Dict[str, Any]]) -> Iterable[List[Dict[str, Any]]]:
+        """executemany needs every row of a statement to carry the same keys"""
+        groups: Dict[frozenset, List[Dict[str, Any]]] = {}
+        for row in rows:
+            groups.setdefault(frozenset(row), []).append(row)
+        return groups.values()
+
+    @staticmethod
+    def _update_batches(pending: Dict[str, Dict[str, Any]], key_name: str) -> Iterable[List[Dict[str, Any]]]:
+        groups: Dict[frozenset, List[Dict[str, Any]]] = {}
+        for key, values in pending.items():
+            groups.setdefault(frozenset(values), []).append(dict(values, **{key_name: key}))
+        return groups.values()
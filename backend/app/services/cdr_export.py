@@ -0,0 +1,194 @@
+import asyncio
+import csv
+import json
+import logging
+import os
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncEngine
+from app.database import engine as default_engine
+from app.models.call import Call
+from app.services.call_queries import export_count_query, export_query
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # only needed for format=parquet
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+# Exported columns, in file order
+COLUMNS = [column.name for column in Call.__table__.columns]
+
+
+def _format(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return json.dumps(value)
+    return value
+
+
+class CsvWriter:
+    def __init__(self, path: str):
+        self._file = open(path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(COLUMNS)
+
+    def write(self, rows: List[Tuple]):
+        self._writer.writerows(
+            [_format(value) for value in row] for row in rows
+        )
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    """Appends each chunk as a row group, so only one chunk is ever held in memory"""
+
+    def __init__(self, path: str):
+        fields = []
+        for column in Call.__table__.columns:
+            if column.name in ('created_at', 'answered_at', 'ended_at'):
+                fields.append(pyarrow.field(column.name, pyarrow.timestamp('us')))
+            else:
+                fields.append(pyarrow.field(column.name, pyarrow.string()))
+        self._schema = pyarrow.schema(fields)
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema)
+
+    def write(self, rows: List[Tuple]):
+        arrays = []
+        for field, values in zip(self._schema, zip(*rows)):
+            if field.name == 'call_metadata':
+                values = [json.dumps(value) if value is not None else None for value in values]
+            arrays.append(pyarrow.array(values, type=field.type))
+        self._writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+# Export formats (also the file extension) and their writers
+FORMATS: Dict[str, type] = {'csv': CsvWriter}
+if pyarrow:
+    FORMATS['parquet'] = ParquetWriter
+
+
+class ExportJob:
+    """One CDR export and its progress"""
+
+    def __init__(self, format: str, export_dir: str, since: Optional[datetime] = None,
+                 until: Optional[datetime] = None, extension_id: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.format = format
+        self.created_at = datetime.utcnow()
+        self.path = os.path.join(export_dir, f"cdr-{self.created_at:%Y%m%d-%H%M%S}-{self.id[:8]}.{format}")
+        self.since = since
+        self.until = until
+        self.extension_id = extension_id
+        self.status = 'queued'  # queued, running, done, failed
+        self.total_rows: Optional[int] = None
+        self.rows_written = 0
+        self.error: Optional[str] = None
+        self.finished_at: Optional[datetime] = None
+
+    @property
+    def filename(self) -> str:
+        return os.path.basename(self.path)
+
+    @property
+    def progress(self) -> Optional[float]:
+        """Fraction of rows written, once the total is known"""
+        if self.status == 'done':
+            return 1.0
+        if not self.total_rows:
+            return None
+        return min(self.rows_written / self.total_rows, 1.0)
+
+
+class CdrExporter:
+    """Runs CDR exports in the background
+
+    Rows are streamed from a server-side cursor chunk_size at a time and each
+    chunk is appended to the file in a worker thread, so memory stays at one
+    chunk whatever the row count and the event loop only ever awaits. At
+    most max_running exports run at once; the rest wait their turn. Jobs are
+    kept in memory, the files in export_dir.
+    """
+
+    def __init__(self, engine: AsyncEngine = default_engine, export_dir: str = './exports',
+                 chunk_size: int = 5000, max_running: int = 1):
+        self.engine = engine
+        self.export_dir = export_dir
+        self.chunk_size = chunk_size
+        self.jobs: Dict[str, ExportJob] = {}
+        self._slots = asyncio.Semaphore(max_running)
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    @property
+    def formats(self) -> List[str]:
+        return list(FORMATS)
+
+    def start(self, format: str = 'csv', since: Optional[datetime] = None,
+              until: Optional[datetime] = None, extension_id: Optional[str] = None) -> ExportJob:
+        """Queue an export and return its job right away"""
+        if format not in FORMATS:
+            raise ValueError(f"Unsupported export format {format!r}, expected one of {', '.join(FORMATS)}")
+        os.makedirs(self.export_dir, exist_ok=True)
+        job = ExportJob(format, self.export_dir, since=since, until=until, extension_id=extension_id)
+        self.jobs[job.id] = job
+        self._tasks[job.id] = asyncio.create_task(self._run(job))
+        return job
+
+    def get(self, job_id: str) -> Optional[ExportJob]:
+        return self.jobs.get(job_id)
+
+    async def stop(self):
+        """Cancel running exports; their partial files are removed"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _run(self, job: ExportJob):
+        partial_path = job.path + '.part'
+        try:
+            async with self._slots:
+                job.status = 'running'
+                await self._export(job, partial_path)
+            os.replace(partial_path, job.path)
+            job.status = 'done'
+            logger.info(f"CDR export {job.id} wrote {job.rows_written} rows to {job.path}")
+        except asyncio.CancelledError:
+            job.status = 'failed'
+            job.error = 'cancelled'
+            raise
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e) or type(e).__name__
+            logger.error(f"CDR export {job.id} failed: {e}")
+        finally:
+            job.finished_at = datetime.utcnow()
+            self._tasks.pop(job.id, None)
+            if job.status != 'done' and os.path.exists(partial_path):
+                os.remove(partial_path)
+
+    async def _export(self, job: ExportJob, path: str):
+        filters = dict(since=job.since, until=job.until, extension_id=job.extension_id)
+        writer = await asyncio.to_thread(FORMATS[job.format], path)
+        try:
+            async with self.engine.connect() as connection:
+                job.total_rows = (await connection.execute(export_count_query(**filters))).scalar()
+                # stream() runs on a server-side cursor where the driver has one
+                result = await connection.stream(
+                    export_query(**filters).execution_options(yield_per=self.chunk_size)
+                )
+                async for rows in result.partitions(self.chunk_size):
+                    await asyncio.to_thread(writer.write, rows)
+                    job.rows_written += len(rows)
+        finally:
+            await asyncio.to_thread(writer.close)
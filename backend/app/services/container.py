@@ -0,0 +1,58 @@
+"""Process-wide service instances shared by the WebSocket and REST APIs
+
+Everything that holds live state (the ESL connection, the active-call
+registry, the extension index, connected clients) is created here once, so
+every router sees the same objects instead of building its own.
+"""
+from app.config import settings
+from app.services.call_manager import CallManager
+from app.services.call_retention import CallRetention
+from app.services.cdr_export import CdrExporter
+from app.services.esl_client import ESLClient
+from app.services.extension_index import ExtensionIndex
+from app.services.websocket_manager import WebSocketManager
+
+websocket_manager = WebSocketManager(
+    send_timeout=settings.ws_send_timeout,
+    client_queue_size=settings.ws_client_queue_size
+)
+esl_client = ESLClient()
+extension_index = ExtensionIndex()
+call_manager = CallManager(websocket_manager, extension_index=extension_index)
+call_retention = CallRetention(
+    policy=settings.call_retention_policy,
+    retention_months=settings.call_retention_months,
+    partitions_ahead=settings.call_partitions_ahead,
+    interval=settings.call_retention_interval,
+    batch_size=settings.call_archive_batch_size
+)
+cdr_exporter = CdrExporter(
+    export_dir=settings.cdr_export_dir,
+    chunk_size=settings.cdr_export_chunk_size,
+    max_running=settings.cdr_export_max_running
+)
+
+
+# Function to get the global instances (for dependency injection)
+def get_websocket_manager() -> WebSocketManager:
+    return websocket_manager
+
+
+def get_call_manager() -> CallManager:
+    return call_manager
+
+
+def get_esl_client() -> ESLClient:
+    return esl_client
+
+
+def get_extension_index() -> ExtensionIndex:
+    return extension_index
+
+
+def get_call_retention() -> CallRetention:
+    return call_retention
+
+
+def get_cdr_exporter() -> CdrExporter:
+    return cdr_exporter
@@ -1,168 +1,464 @@
 import asyncio
+import random
 import socket
 import logging
-from typing import Dict, Callable, Optional
+from typing import Any, Dict, Callable, List, Optional, Set, Tuple, Union
+from uuid import uuid4
+from app.services.esl_connection import ESLConnection
+from app.services.esl_protocol import ESLFrame
+from app.services.event_queue import ShardedEventQueue
+from app.utils.esl_capture import ESLCaptureWriter
 from app.utils.ssh_tunnel import SSHTunnel
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
 
+class BackgroundJob:
+    """Handle for a bgapi command whose result arrives in a BACKGROUND_JOB event"""
+
+    def __init__(self, job_uuid: str, command: str, future: asyncio.Future):
+        self.job_uuid = job_uuid
+        self.command = command
+        self._future = future
+        
+    def done(self) -> bool:
+        return self._future.done()
+        
+    def __await__(self):
+        return self._future.__await__()
+
+
+# Events the client always needs regardless of registered handlers
+INTERNAL_EVENTS = {'BACKGROUND_JOB'}
+
+
 class ESLClient:
     def __init__(self):
-        self.reader: Optional[asyncio.StreamReader] = None
-        self.writer: Optional[asyncio.StreamWriter] = None
         self.ssh_tunnel: Optional[SSHTunnel] = None
         self.local_port: Optional[int] = None
-        self.event_handlers: Dict[str, Callable] = {}
-        self.connected = False
+        # 'tunnel' dials a local port forwarded over SSH, 'channel' talks to
+        # the SSH direct-tcpip channel in-process and 'direct' dials the ESL
+        # port without SSH (local FreeSWITCH or the replay server)
+        self.transport = settings.esl_transport
+        self.capture: Optional[ESLCaptureWriter] = None
+        self.event_handlers: Dict[str, List[Callable]] = {}
+        self.command_timeout = 5.0
+        self.job_timeout = 120.0
+        self.event_connection: Optional[ESLConnection] = None
+        self.command_pool: List[Optional[ESLConnection]] = []
+        self.pool_size = settings.esl_command_pool_size
+        self.pool_health_interval = settings.esl_pool_health_interval
+        self._health_task: Optional[asyncio.Task] = None
+        self._pending_jobs: Dict[str, asyncio.Future] = {}
+        self._subscribed_events: Set[str] = set()
+        self.event_queue = ShardedEventQueue(
+            self._dispatch_event,
+            workers=settings.esl_event_workers,
+            queue_size=settings.esl_event_queue_size
+        )
+        self.event_filters: List[Tuple[str, str]] = [
+            self._parse_filter(rule) for rule in settings.freeswitch_event_filters
+        ]
+        self.connect_handlers: List[Callable] = []
+        self.reconnect_initial_delay = settings.esl_reconnect_initial_delay
+        self.reconnect_max_delay = settings.esl_reconnect_max_delay
+        self._supervisor_task: Optional[asyncio.Task] = None
+        self._connection_lost = asyncio.Event()
+        
+    @property
+    def connected(self) -> bool:
+        """True while the event connection is up"""
+        return bool(self.event_connection and self.event_connection.connected)
         
     async def connect(self):
         """Connect to FreeSWITCH ESL through SSH tunnel"""
         try:
-            logger.info("🚇 Step 1: Creating SSH tunnel...")
-            # Create SSH tunnel
-            self.ssh_tunnel = SSHTunnel(
-                ssh_host=settings.freeswitch_host,
-                ssh_username=settings.ssh_username,
-                ssh_key_path=settings.ssh_private_key_path,
-                remote_host='localhost',
-                remote_port=settings.freeswitch_esl_port
-            )
-            
-            logger.info("🚇 Step 2: Starting SSH tunnel...")
-            self.local_port = await self.ssh_tunnel.start()
-            logger.info(f"✅ SSH tunnel started on local port {self.local_port}")
+            if self.transport != 'direct':
+                logger.info("🚇 Step 1: Creating SSH tunnel...")
+                # Create SSH tunnel
+                self.ssh_tunnel = SSHTunnel(
+                    ssh_host=settings.freeswitch_host,
+                    ssh_username=settings.ssh_username,
+                    ssh_key_path=settings.ssh_private_key_path,
+                    remote_host='localhost',
+                    remote_port=settings.freeswitch_esl_port,
+                    buffer_size=settings.ssh_tunnel_buffer_size
+                )
+                
+            if self.transport == 'channel':
+                # ESL sockets are SSH channels read directly by the event loop
+                logger.info("🚇 Step 2: Opening SSH connection...")
+                await self.ssh_tunnel.connect()
+                logger.info("✅ SSH connection established")
+            elif self.transport == 'tunnel':
+                logger.info("🚇 Step 2: Starting SSH tunnel...")
+                self.local_port = await self.ssh_tunnel.start()
+                logger.info(f"✅ SSH tunnel started on local port {self.local_port}")
+                
+            if settings.esl_capture_path and not self.capture:
+                self.capture = ESLCaptureWriter(settings.esl_capture_path)
+                logger.info(f"⏺ Capturing ESL events to {settings.esl_capture_path}")
+                
+            # Handlers run on the queue workers, never on the ESL reader
+            self.event_queue.start()
             
-            # Wait a moment for SSH tunnel to be ready
-            await asyncio.sleep(2)
+            # Cleared before the event connection exists, so a drop at any
+            # point from here on is still seen by _supervise
+            self._connection_lost.clear()
             
-            # Connect to ESL through tunnel using asyncio streams
-            logger.info(f"🔌 Step 3: Connecting to ESL through tunnel on localhost:{self.local_port}")
-            self.reader, self.writer = await asyncio.wait_for(
-                asyncio.open_connection('localhost', self.local_port),
-                timeout=10.0
+            # Open and authenticate the event connection
+            logger.info(f"🔌 Step 3: Connecting to ESL ({self.transport})")
+            self.event_connection = await self._open_connection(
+                'events', on_event=self._process_event, on_close=self._on_event_connection_closed,
+                capture=self.capture
             )
-            logger.info("✅ Connected to ESL through tunnel")
+            logger.info("✅ Connected and authenticated to ESL")
             
-            # Read initial ESL welcome message
-            logger.info("📨 Step 4: Reading ESL welcome message...")
-            welcome = await self._read_response()
-            logger.info(f"ESL Welcome: {welcome.strip()}")
+            # Subscribe to the events we have handlers for and re-apply filters
+            logger.info("📡 Step 4: Subscribing to events...")
+            self._subscribed_events = set()
+            await self._subscribe(self._wanted_events())
+            await self._apply_filters()
             
-            # Authenticate
-            logger.info("🔑 Step 5: Authenticating...")
-            auth_response = await self._send_command(f"auth {settings.freeswitch_esl_password}")
-            logger.info(f"Auth response: {auth_response.strip()}")
+            # Command-only connections keep call-control off the event socket
+            logger.info(f"🧰 Step 5: Opening {self.pool_size} ESL command connections...")
+            self.command_pool = [None] * self.pool_size
+            await asyncio.gather(*(self._replace_pool_connection(i) for i in range(self.pool_size)))
+            self._health_task = asyncio.create_task(self._pool_health_loop())
             
-            # Subscribe to events
-            logger.info("📡 Step 6: Subscribing to events...")
-            events_response = await self._send_command("events json ALL")
-            logger.info(f"Events response: {events_response.strip()}")
-            
-            self.connected = True
             logger.info("🎉 ESL connection fully established")
             
-            # Start event listener
-            asyncio.create_task(self._event_listener())
-            
         except Exception as e:
             logger.error(f"❌ Failed to connect to ESL: {e}")
-            import traceback
-            logger.error(f"Full traceback: {traceback.format_exc()}")
-            await self.disconnect()
+            await self._close_connections()
+            raise
+            
+    def start(self):
+        """Start the reconnect supervisor in the background"""
+        if not self._supervisor_task:
+            self._supervisor_task = asyncio.create_task(self._supervise())
+            
+    def register_connect_handler(self, handler: Callable):
+        """Register a coroutine run with this client after every (re)connect"""
+        self.connect_handlers.append(handler)
+        
+    async def _supervise(self):
+        """Keep the ESL connection up forever, backing off exponentially with jitter"""
+        delay = self.reconnect_initial_delay
+        while True:
+            try:
+                await self.connect()
+            except Exception:
+                # Equal jitter keeps a fleet of backends from reconnecting in lockstep
+                wait = random.uniform(delay / 2, delay)
+                logger.info(f"Retrying ESL connection in {wait:.1f}s")
+                await asyncio.sleep(wait)
+                delay = min(delay * 2, self.reconnect_max_delay)
+                continue
+                
+            delay = self.reconnect_initial_delay
+            for handler in self.connect_handlers:
+                try:
+                    await handler(self)
+                except Exception as e:
+                    logger.error(f"Error in ESL connect handler {handler!r}: {e}")
+                    
+            await self._connection_lost.wait()
+            logger.warning("🔌 ESL connection lost, reconnecting...")
+            await self._close_connections()
             
     async def disconnect(self):
-        """Disconnect from ESL and close SSH tunnel"""
-        self.connected = False
+        """Stop reconnecting, disconnect from ESL and close SSH tunnel"""
+        if self._supervisor_task:
+            self._supervisor_task.cancel()
+            self._supervisor_task = None
+            
+        await self._close_connections()
+        await self.event_queue.stop()
         
-        if self.writer:
-            self.writer.close()
-            await self.writer.wait_closed()
-            self.writer = None
-            self.reader = None
+        if self.capture:
+            self.capture.close()
+            self.capture = None
+        
+    async def _close_connections(self):
+        """Close the ESL sockets and the SSH tunnel, keeping the event queue running"""
+        if self._health_task:
+            self._health_task.cancel()
+            self._health_task = None
+            
+        for connection in self.command_pool:
+            if connection:
+                await connection.close()
+        self.command_pool = []
+        
+        if self.event_connection:
+            self.event_connection.on_close = None
+            await self.event_connection.close()
+            self.event_connection = None
+        self._fail_pending_jobs(ConnectionError("ESL connection closed"))
             
         if self.ssh_tunnel:
             await self.ssh_tunnel.stop()
             self.ssh_tunnel = None
             
-    async def _send_command(self, command: str) -> str:
-        """Send command to FreeSWITCH"""
-        if not self.writer:
-            raise Exception("Not connected to ESL")
-            
-        self.writer.write(f"{command}\n\n".encode())
-        await self.writer.drain()
-        return await self._read_response()
+    async def _open_connection(self, name: str, **kwargs) -> ESLConnection:
+        """Open a new authenticated ESL socket through the SSH transport"""
+        reader, writer = await asyncio.wait_for(self._open_streams(), timeout=10.0)
+        connection = ESLConnection(name, command_timeout=self.command_timeout, **kwargs)
+        try:
+            await connection.open(reader, writer, settings.freeswitch_esl_password)
+        except Exception:
+            await connection.close()
+            raise
+        return connection
         
-    async def _read_response(self) -> str:
-        """Read response from FreeSWITCH"""
-        if not self.reader:
-            raise Exception("Not connected to ESL")
+    async def _open_streams(self):
+        """Open a raw stream pair to the ESL port"""
+        if self.transport == 'channel':
+            return await self.ssh_tunnel.open_stream()
+        if self.transport == 'direct':
+            return await asyncio.open_connection(settings.freeswitch_host, settings.freeswitch_esl_port)
+        return await asyncio.open_connection('localhost', self.local_port)
+        
+    def _on_event_connection_closed(self, connection: ESLConnection):
+        """The event socket went away, so no BACKGROUND_JOB will ever arrive"""
+        self._fail_pending_jobs(ConnectionError("ESL event connection lost"))
+        self._connection_lost.set()
+        
+    async def _replace_pool_connection(self, index: int):
+        """(Re)open command connection number index, leaving the slot empty on failure"""
+        old = self.command_pool[index]
+        self.command_pool[index] = None
+        if old:
+            await old.close()
             
-        response = ""
         try:
-            # Read with timeout to prevent hanging
-            while True:
-                line = await asyncio.wait_for(self.reader.readline(), timeout=5.0)
-                if not line:
-                    #logger.info("📭 No more data from ESL")
-                    break
-                    
-                line_str = line.decode().rstrip('\r\n')
-                response += line_str + '\n'
-                
-                # ESL responses end with an empty line
-                if line_str == "":
-                    break
-                    
-        except asyncio.TimeoutError:
-            logger.warning("⏰ Timeout reading ESL response")
-            if response:
-                logger.info(f"📨 Partial response received: {response}")
+            self.command_pool[index] = await self._open_connection(f"command-{index}")
         except Exception as e:
-            logger.error(f"❌ Error reading ESL response: {e}")
+            logger.warning(f"Could not open ESL command connection {index}: {e}")
+            
+    async def _check_pool_connection(self, index: int):
+        """Health-check one command connection and replace it if it fails"""
+        connection = self.command_pool[index]
+        if connection and connection.connected:
+            try:
+                await connection.send_command("api uptime")
+                return
+            except Exception as e:
+                logger.warning(f"ESL command connection {index} failed health check: {e}")
                 
-        return response
+        await self._replace_pool_connection(index)
         
-    async def _event_listener(self):
-        """Listen for events from FreeSWITCH"""
+    async def _pool_health_loop(self):
+        """Periodically health-check the command pool while the event connection is up"""
         while self.connected:
+            await asyncio.sleep(self.pool_health_interval)
+            await asyncio.gather(
+                *(self._check_pool_connection(i) for i in range(len(self.command_pool)))
+            )
+            
+    def _command_connection(self) -> ESLConnection:
+        """Pick the least busy healthy command connection
+
+        Falls back to the event connection when the whole pool is down.
+        """
+        candidates = [c for c in self.command_pool if c and c.connected]
+        if candidates:
+            return min(candidates, key=lambda c: c.pending)
+        if self.connected:
+            return self.event_connection
+        raise Exception("Not connected to ESL")
+        
+    async def _send_command(self, command: str) -> ESLFrame:
+        """Send a command on the event connection (subscriptions and filters)"""
+        if not self.event_connection:
+            raise Exception("Not connected to ESL")
+        return await self.event_connection.send_command(command)
+        
+    def _resolve_job(self, event: Dict[str, Any]):
+        """Complete the bgapi job a BACKGROUND_JOB event belongs to"""
+        future = self._pending_jobs.pop(event.get('Job-UUID', ''), None)
+        if future and not future.done():
+            future.set_result(event.get('_body', ''))
+            
+    def _expire_job(self, job_uuid: str):
+        """Give up on a bgapi job whose BACKGROUND_JOB event never arrived"""
+        future = self._pending_jobs.pop(job_uuid, None)
+        if future and not future.done():
+            future.set_exception(asyncio.TimeoutError(f"bgapi job {job_uuid} timed out"))
+            
+    def _fail_pending_jobs(self, error: Exception):
+        """Fail every bgapi job still waiting for its result"""
+        for future in self._pending_jobs.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending_jobs.clear()
+        
+    @staticmethod
+    def event_key(event: Dict[str, Any]) -> str:
+        """Dispatch key of an event: its Event-Name, or Event-Subclass for CUSTOM events"""
+        event_name = event.get('Event-Name', '')
+        if event_name == 'CUSTOM':
+            return event.get('Event-Subclass', event_name)
+        return event_name
+        
+    async def _process_event(self, event: Dict[str, Any]):
+        """Take a parsed event off the ESL reader
+
+        Job results are resolved right away; everything else is queued for
+        the workers, and this blocks the reader while the queue is full.
+        """
+        key = self.event_key(event)
+        if key == 'BACKGROUND_JOB':
+            self._resolve_job(event)
+            
+        if key in self.event_handlers:
+            await self.event_queue.put(event)
+            
+    async def _dispatch_event(self, event: Dict[str, Any]):
+        """Run the handlers registered for an event (on a queue worker)"""
+        key = self.event_key(event)
+        for handler in self.event_handlers.get(key, ()):
             try:
-                event_data = await self._read_response()
-                if event_data:
-                    await self._process_event(event_data)
+                await handler(event)
             except Exception as e:
-                logger.error(f"Error in event listener: {e}")
-                break
-                
-    async def _process_event(self, event_data: str):
-        """Process incoming events"""
-        # Parse event data and trigger handlers
-        for event_type, handler in self.event_handlers.items():
-            if event_type in event_data:
-                await handler(event_data)
+                logger.error(f"Error in {key} handler {handler!r}: {e}")
                 
     def register_event_handler(self, event_type: str, handler: Callable):
-        """Register event handler"""
-        self.event_handlers[event_type] = handler
+        """Register event handler; several handlers may share an event
+
+        CUSTOM events are registered by their subclass (e.g. 'conference::maniacal').
+        """
+        self.event_handlers.setdefault(event_type, []).append(handler)
+        if self.connected and event_type not in self._subscribed_events:
+            asyncio.create_task(self._subscribe({event_type}))
+            
+    def _wanted_events(self) -> Set[str]:
+        """Event names to subscribe to, derived from the registered handlers"""
+        return set(self.event_handlers) | INTERNAL_EVENTS
+        
+    async def _subscribe(self, events: Set[str]):
+        """Add events to this connection's subscription"""
+        events = events - self._subscribed_events
+        if not events:
+            return
+            
+        names = sorted(e for e in events if '::' not in e)
+        subclasses = sorted(e for e in events if '::' in e)
+        if subclasses:
+            names += ['CUSTOM'] + subclasses
+            
+        response = await self._send_command(f"events json {' '.join(names)}")
+        if not response.reply_text.startswith("+OK"):
+            raise Exception(f"ESL event subscription failed: {response.reply_text}")
+        self._subscribed_events |= events
+        logger.info(f"Subscribed to ESL events: {' '.join(names)}")
+        
+    @staticmethod
+    def _parse_filter(rule: str) -> Tuple[str, str]:
+        """Split a 'Header value' filter rule from the settings"""
+        header, _, value = rule.strip().partition(' ')
+        if not header or not value:
+            raise ValueError(f"Invalid ESL event filter: {rule!r}")
+        return header, value.strip()
+        
+    async def _apply_filters(self):
+        """Send the configured filter rules on a freshly connected socket
+
+        FreeSWITCH lets an event through when it matches any filter, so once
+        filters are in place the internal events need a filter of their own.
+        """
+        if not self.event_filters:
+            return
+            
+        rules = list(self.event_filters)
+        rules += [('Event-Name', name) for name in sorted(INTERNAL_EVENTS)]
+        for header, value in rules:
+            response = await self._send_command(f"filter {header} {value}")
+            if not response.reply_text.startswith("+OK"):
+                logger.warning(f"ESL filter '{header} {value}' rejected: {response.reply_text}")
+                
+    async def add_event_filter(self, header: str, value: str):
+        """Only receive events whose header matches value (use /regex/ for patterns)
+
+        The rule is kept on the client and re-applied after every reconnect.
+        """
+        first_filter = not self.event_filters
+        if (header, value) not in self.event_filters:
+            self.event_filters.append((header, value))
+        if not self.connected:
+            return
+            
+        if first_filter:
+            await self._apply_filters()
+        else:
+            await self._send_command(f"filter {header} {value}")
+            
+    async def remove_event_filter(self, header: str, value: str):
+        """Drop a filter rule added with add_event_filter"""
+        if (header, value) not in self.event_filters:
+            return
+            
+        self.event_filters.remove((header, value))
+        if self.connected:
+            await self._send_command(f"filter delete {header} {value}")
+            if not self.event_filters:
+                for name in sorted(INTERNAL_EVENTS):
+                    await self._send_command(f"filter delete Event-Name {name}")
+        
+    async def api(self, command: str) -> str:
+        """Run a blocking API command and return its response body"""
+        response = await self._command_connection().send_command(f"api {command}")
+        return response.text
+        
+    async def bgapi(self, command: str) -> BackgroundJob:
+        """Queue an API command in the background and return as soon as FreeSWITCH accepts it
+
+        The Job-UUID is chosen here and sent with the command, so the job is
+        registered before its BACKGROUND_JOB event can possibly arrive.
+        """
+        loop = asyncio.get_running_loop()
+        job_uuid = str(uuid4())
+        future = loop.create_future()
+        self._pending_jobs[job_uuid] = future
+        
+        try:
+            reply = await self._command_connection().send_command(
+                f"bgapi {command}\nJob-UUID: {job_uuid}"
+            )
+        except Exception:
+            self._pending_jobs.pop(job_uuid, None)
+            raise
+            
+        if not reply.reply_text.startswith("+OK"):
+            self._pending_jobs.pop(job_uuid, None)
+            raise Exception(f"bgapi rejected: {reply.reply_text}")
+            
+        loop.call_later(self.job_timeout, self._expire_job, job_uuid)
+        return BackgroundJob(job_uuid, command, future)
+        
+    async def _run(self, command: str, background: bool) -> Union[str, BackgroundJob]:
+        """Run an API command either blocking or as a bgapi job"""
+        if background:
+            return await self.bgapi(command)
+        return await self.api(command)
         
-    async def originate_call(self, extension: str, destination: str) -> str:
+    async def originate_call(self, extension: str, destination: str,
+                             background: bool = False) -> Union[str, BackgroundJob]:
         """Originate a call"""
-        command = f"api originate user/{extension} {destination}"
-        return await self._send_command(command)
+        return await self._run(f"originate user/{extension} {destination}", background)
         
-    async def transfer_call(self, uuid: str, destination: str) -> str:
+    async def transfer_call(self, uuid: str, destination: str,
+                            background: bool = False) -> Union[str, BackgroundJob]:
         """Transfer a call"""
-        command = f"api uuid_transfer {uuid} {destination}"
-        return await self._send_command(command)
+        return await self._run(f"uuid_transfer {uuid} {destination}", background)
         
-    async def park_call(self, uuid: str, orbit: str) -> str:
+    async def park_call(self, uuid: str, orbit: str,
+                        background: bool = False) -> Union[str, BackgroundJob]:
         """Park a call"""
-        command = f"api uuid_transfer {uuid} park+{orbit}"
-        return await self._send_command(command)
+        return await self._run(f"uuid_transfer {uuid} park+{orbit}", background)
         
-    async def hangup_call(self, uuid: str) -> str:
+    async def hangup_call(self, uuid: str, background: bool = False) -> Union[str, BackgroundJob]:
         """Hangup a call"""
-        command = f"api uuid_kill {uuid}"
-        return await self._send_command(command)
\ No newline at end of file
+        return await self._run(f"uuid_kill {uuid}", background)
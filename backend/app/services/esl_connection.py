@@ -0,0 +1,138 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+from app.services.esl_protocol import ESLFrame, read_frame
+from app.utils.esl_capture import ESLCaptureWriter
+
+logger = logging.getLogger(__name__)
+
+
+class ESLConnection:
+    """One authenticated socket to the FreeSWITCH event socket
+
+    A single reader task owns the socket: command/reply and api/response
+    frames resolve pending commands in FIFO order, and events are handed
+    to on_event when the connection carries a subscription.
+    """
+
+    def __init__(self, name: str,
+                 on_event: Optional[Callable[[Dict[str, Any]], Awaitable]] = None,
+                 on_close: Optional[Callable[["ESLConnection"], None]] = None,
+                 command_timeout: float = 5.0,
+                 capture: Optional[ESLCaptureWriter] = None):
+        self.name = name
+        self.capture = capture
+        self.on_event = on_event
+        self.on_close = on_close
+        self.command_timeout = command_timeout
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.connected = False
+        self._pending_replies: Deque[asyncio.Future] = deque()
+        self._reader_task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        """Number of commands waiting for a reply on this connection"""
+        return len(self._pending_replies)
+
+    async def open(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, password: str):
+        """Take over an open stream pair, read the welcome frame and authenticate"""
+        self.reader, self.writer = reader, writer
+
+        welcome = await read_frame(self.reader, timeout=self.command_timeout)
+        if welcome.content_type != 'auth/request':
+            raise Exception(f"Unexpected ESL welcome: {welcome.content_type}")
+
+        self._reader_task = asyncio.create_task(self._reader_loop())
+
+        auth_response = await self.send_command(f"auth {password}")
+        if not auth_response.reply_text.startswith("+OK"):
+            raise Exception(f"ESL authentication failed: {auth_response.reply_text}")
+
+        self.connected = True
+
+    async def close(self):
+        """Close the socket and fail any command still waiting"""
+        self.connected = False
+
+        if self._reader_task:
+            self._reader_task.cancel()
+            self._reader_task = None
+        self._fail_pending_replies(ConnectionError(f"ESL connection {self.name} closed"))
+
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except Exception:
+                pass
+            self.writer = None
+            self.reader = None
+
+    async def send_command(self, command: str) -> ESLFrame:
+        """Send command to FreeSWITCH and wait for its reply frame"""
+        if not self.writer:
+            raise Exception("Not connected to ESL")
+
+        # FreeSWITCH answers commands in the order they were sent, so the
+        # future is queued in the same step as the write to keep them aligned
+        future = asyncio.get_running_loop().create_future()
+        self._pending_replies.append(future)
+        self.writer.write(f"{command}\n\n".encode())
+        await self.writer.drain()
+        return await asyncio.wait_for(future, timeout=self.command_timeout)
+
+    async def _reader_loop(self):
+        """Read every frame from FreeSWITCH and route it to replies or events"""
+        try:
+            while True:
+                frame = await read_frame(self.reader)
+                content_type = frame.content_type
+                if self.capture:
+                    self.capture.record(frame.raw)
+
+                if content_type in ('command/reply', 'api/response'):
+                    self._resolve_reply(frame)
+                elif content_type == 'text/event-json':
+                    if self.on_event:
+                        try:
+                            await self.on_event(frame.json())
+                        except Exception as e:
+                            logger.error(f"Error processing ESL event: {e}")
+                elif content_type == 'text/disconnect-notice':
+                    logger.warning(f"📭 ESL disconnect notice received on {self.name}")
+                    break
+                else:
+                    logger.debug(f"Ignoring ESL frame {frame!r}")
+        except asyncio.CancelledError:
+            raise
+        except asyncio.IncompleteReadError:
+            logger.warning(f"📭 ESL connection {self.name} closed by FreeSWITCH")
+        except Exception as e:
+            logger.error(f"Error in ESL reader for {self.name}: {e}")
+
+        self.connected = False
+        self._reader_task = None
+        self._fail_pending_replies(ConnectionError(f"ESL connection {self.name} lost"))
+        if self.on_close:
+            self.on_close(self)
+
+    def _resolve_reply(self, frame: ESLFrame):
+        """Hand a reply frame to the oldest command still waiting for one"""
+        if not self._pending_replies:
+            logger.warning(f"Unexpected ESL reply with no pending command: {frame.text}")
+            return
+
+        future = self._pending_replies.popleft()
+        # A command that timed out still owns its slot in the FIFO
+        if not future.done():
+            future.set_result(frame)
+
+    def _fail_pending_replies(self, error: Exception):
+        """Fail every command still waiting for a reply"""
+        while self._pending_replies:
+            future = self._pending_replies.popleft()
+            if not future.done():
+                future.set_exception(error)
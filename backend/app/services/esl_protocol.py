@@ -0,0 +1,83 @@
+import asyncio
+import json
+from typing import Any, Dict, Optional
+from urllib.parse import unquote
+
+HEADER_TERMINATOR = b"\n\n"
+
+
+class ESLFrame:
+    """A single framed message read from the FreeSWITCH event socket"""
+
+    __slots__ = ("headers", "body", "raw_headers")
+
+    def __init__(self, headers: Dict[str, str], body: bytes = b"", raw_headers: bytes = b""):
+        self.headers = headers
+        self.body = body
+        # The header block exactly as received, terminator included
+        self.raw_headers = raw_headers
+
+    @property
+    def raw(self) -> bytes:
+        """The frame as it appeared on the wire"""
+        return self.raw_headers + self.body
+
+    @property
+    def content_type(self) -> str:
+        return self.headers.get("Content-Type", "")
+
+    @property
+    def reply_text(self) -> str:
+        return self.headers.get("Reply-Text", "")
+
+    @property
+    def text(self) -> str:
+        """Body of the frame as text, falling back to the Reply-Text header"""
+        if self.body:
+            return self.body.decode()
+        return self.reply_text
+
+    def json(self) -> Dict[str, Any]:
+        """Decode a JSON body (text/event-json frames)"""
+        return json.loads(self.body)
+
+    def __repr__(self) -> str:
+        return f"ESLFrame({self.content_type!r}, {len(self.body)} bytes)"
+
+
+def parse_headers(block: bytes) -> Dict[str, str]:
+    """Parse an ESL header block into a dict (values are URL-decoded)"""
+    headers: Dict[str, str] = {}
+    for line in block.decode().split("\n"):
+        if not line:
+            continue
+        name, _, value = line.partition(":")
+        value = value.strip()
+        if "%" in value:
+            value = unquote(value)
+        headers[name.strip()] = value
+    return headers
+
+
+def encode_frame(headers: Dict[str, str], body: bytes = b"") -> bytes:
+    """Serialize a frame the way FreeSWITCH sends it"""
+    if body:
+        headers = dict(headers, **{"Content-Length": str(len(body))})
+    block = "".join(f"{name}: {value}\n" for name, value in headers.items())
+    return block.encode() + b"\n" + body
+
+
+async def read_frame(reader: asyncio.StreamReader, timeout: Optional[float] = None) -> ESLFrame:
+    """Read one complete frame: the header block, then exactly Content-Length body bytes
+
+    Raises asyncio.IncompleteReadError when the peer closes the connection.
+    """
+    if timeout is not None:
+        return await asyncio.wait_for(read_frame(reader), timeout=timeout)
+
+    block = await reader.readuntil(HEADER_TERMINATOR)
+    headers = parse_headers(block[:-len(HEADER_TERMINATOR)])
+
+    content_length = headers.get("Content-Length")
+    body = await reader.readexactly(int(content_length)) if content_length else b""
+    return ESLFrame(headers, body, raw_headers=block)
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedEventQueue:
+    """Bounded queue between the ESL reader and the event handlers
+
+    Events are sharded by Unique-ID over a fixed set of worker tasks, so
+    events for one call are handled in order while different calls are
+    handled concurrently. When a shard is full, put() blocks the reader,
+    which in turn stops reading the socket and pushes back on FreeSWITCH.
+    """
+
+    def __init__(self, handler: Callable[[Dict[str, Any]], Awaitable],
+                 workers: int = 4, queue_size: int = 1000):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.shard_size = max(1, queue_size // self.workers)
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self.processed = 0
+        self.blocked_puts = 0
+        self.blocked_seconds = 0.0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        """Start the worker tasks (no-op when already running)"""
+        if self.running:
+            return
+        self._queues = [asyncio.Queue(maxsize=self.shard_size) for _ in range(self.workers)]
+        self._tasks = [
+            asyncio.create_task(self._worker(queue)) for queue in self._queues
+        ]
+
+    async def stop(self, timeout: Optional[float] = 10.0):
+        """Let the workers drain what is queued, then stop them"""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self._queues)),
+                timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Event queue not drained on stop, dropping {self.depth} events")
+
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._queues = []
+
+    @staticmethod
+    def shard_key(event: Dict[str, Any]) -> str:
+        """Events for the same channel must share a shard"""
+        return event.get('Unique-ID') or event.get('Event-Name', '')
+
+    async def put(self, event: Dict[str, Any]):
+        """Queue an event, waiting for room in its shard if necessary"""
+        if not self.running:
+            raise RuntimeError("Event queue is not running")
+
+        queue = self._queues[hash(self.shard_key(event)) % self.workers]
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.blocked_puts += 1
+            started = time.monotonic()
+            await queue.put(event)
+            self.blocked_seconds += time.monotonic() - started
+
+    @property
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and backpressure counters for monitoring"""
+        return {
+            'workers': self.workers,
+            'depth': self.depth,
+            'shard_depths': [queue.qsize() for queue in self._queues],
+            'capacity': self.shard_size * self.workers,
+            'processed': self.processed,
+            'blocked_puts': self.blocked_puts,
+            'blocked_seconds': round(self.blocked_seconds, 3),
+        }
+
+    async def _worker(self, queue: asyncio.Queue):
+        """Handle the events of one shard in arrival order"""
+        while True:
+            event = await queue.get()
+            try:
+                await self.handler(event)
+            except Exception as e:
+                logger.error(f"Error handling queued event: {e}")
+            finally:
+                self.processed += 1
+                queue.task_done()
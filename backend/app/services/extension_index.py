@@ -0,0 +1,89 @@
+import logging
+from typing import Dict, List, Optional
+from sqlalchemy import String, cast, select
+from app.database import async_session_maker
+from app.models.user import Extension, User
+
+logger = logging.getLogger(__name__)
+
+
+class ExtensionEntry:
+    """Detached copy of an Extension row held by the index"""
+
+    __slots__ = ("id", "extension_number", "display_name", "user_id", "is_active", "department")
+
+    def __init__(self, id: str, extension_number: str, display_name: Optional[str] = None,
+                 user_id: Optional[str] = None, is_active: bool = True,
+                 department: Optional[str] = None):
+        self.id = id
+        self.extension_number = extension_number
+        self.display_name = display_name
+        self.user_id = user_id
+        self.is_active = is_active
+        # Department of the owning user, for department topic routing
+        self.department = department
+
+    @classmethod
+    def from_model(cls, extension: Extension, department: Optional[str] = None) -> "ExtensionEntry":
+        return cls(
+            id=extension.id,
+            extension_number=extension.extension_number,
+            display_name=extension.display_name,
+            user_id=str(extension.user_id) if extension.user_id else None,
+            is_active=extension.is_active,
+            department=department
+        )
+
+
+class ExtensionIndex:
+    """In-memory extension lookup by number and by id
+
+    Loaded once at startup; the extensions API keeps it current by calling
+    refresh() after every write, so call attribution never touches the DB.
+    """
+
+    def __init__(self, session_maker=async_session_maker):
+        self.session_maker = session_maker
+        self._by_id: Dict[str, ExtensionEntry] = {}
+        self._by_number: Dict[str, ExtensionEntry] = {}
+
+    async def load(self):
+        """Replace the index with the current contents of the extensions table"""
+        async with self.session_maker() as session:
+            result = await session.execute(self._query())
+            entries = [ExtensionEntry.from_model(extension, department) for extension, department in result.all()]
+
+        self._by_id = {entry.id: entry for entry in entries}
+        self._by_number = {entry.extension_number: entry for entry in entries}
+        logger.info(f"Loaded {len(entries)} extensions into the extension index")
+
+    async def refresh(self, extension_id: str):
+        """Re-read one extension after it was written to the DB"""
+        async with self.session_maker() as session:
+            result = await session.execute(self._query().where(Extension.id == extension_id))
+            row = result.first()
+        if row:
+            self.put(ExtensionEntry.from_model(*row))
+
+    def put(self, entry: ExtensionEntry):
+        previous = self._by_id.get(entry.id)
+        if previous and self._by_number.get(previous.extension_number) is previous:
+            del self._by_number[previous.extension_number]
+        self._by_id[entry.id] = entry
+        self._by_number[entry.extension_number] = entry
+
+    def by_id(self, extension_id: str) -> Optional[ExtensionEntry]:
+        return self._by_id.get(extension_id)
+
+    def by_number(self, extension_number: Optional[str], include_inactive: bool = False) -> Optional[ExtensionEntry]:
+        """Extension that owns a number, if any (active ones only unless include_inactive)"""
+        entry = self._by_number.get(extension_number)
+        return entry if entry and (entry.is_active or include_inactive) else None
+
+    def active(self) -> List[ExtensionEntry]:
+        return [entry for entry in self._by_id.values() if entry.is_active]
+
+    @staticmethod
+    def _query():
+        # users.id is a native UUID on PostgreSQL while extensions.user_id is a string
+        return select(Extension, User.department).outerjoin(User, Extension.user_id == cast(User.id, String))
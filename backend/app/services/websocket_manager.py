@@ -1,65 +1,291 @@
+import asyncio
+import itertools
 import json
 import logging
-from typing import Dict, Set
+from collections import OrderedDict
+from functools import partial
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple, Union
 from fastapi import WebSocket
 from fastapi.websockets import WebSocketDisconnect
 
+try:
+    import msgpack
+except ImportError:  # only needed by clients that negotiate encoding=msgpack
+    msgpack = None
+
 logger = logging.getLogger(__name__)
 
 
+# A text frame (JSON) or a binary frame (MessagePack)
+Frame = Union[str, bytes]
+
+# Wire encodings a client can pick with /ws?encoding=...; JSON is the default
+ENCODERS: Dict[str, Callable[[Dict[str, Any]], Frame]] = {'json': json.dumps}
+if msgpack:
+    ENCODERS['msgpack'] = partial(msgpack.packb, use_bin_type=True)
+
+
+# Receives every event; what clients are subscribed to until they ask otherwise
+ALL_TOPIC = 'all'
+
+# Topic prefixes, e.g. "extension:1001", "department:Sales", "orbit:701", "conference:3000"
+TOPIC_KINDS = ('extension', 'department', 'orbit', 'conference')
+
+
+def validate_topic(topic: str) -> str:
+    """Return topic unchanged, or raise ValueError if it is not a known form"""
+    if topic == ALL_TOPIC:
+        return topic
+    kind, _, value = topic.partition(':')
+    if kind not in TOPIC_KINDS or not value:
+        raise ValueError(f"Unknown topic '{topic}'")
+    return topic
+
+
+class ClientQueueFull(Exception):
+    """A client has more non-coalescible messages pending than it may buffer"""
+
+
+class WebSocketClient:
+    """One connected client: a bounded outbound queue drained by its own writer task
+
+    Call updates are keyed by call uuid, so a client that falls behind only
+    ever holds the latest state of each call rather than every step of it.
+    """
+
+    def __init__(self, websocket: WebSocket, user_id: Optional[str] = None, max_pending: int = 256,
+                 encoding: str = 'json'):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.encoding = encoding
+        self.encode = ENCODERS[encoding]
+        self.max_pending = max_pending
+        self.coalesced = 0
+        self.topics: Set[str] = {ALL_TOPIC}
+        self._pending: "OrderedDict[Hashable, Tuple[Dict[str, Any], Frame]]" = OrderedDict()
+        self._ready = asyncio.Event()
+        self._sequence = itertools.count()
+        self.writer_task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def enqueue(self, message: Dict[str, Any], frame: Frame):
+        """Queue an encoded message, folding it into a pending update for the same call"""
+        call_uuid = self.coalesce_key(message)
+        if call_uuid is not None and call_uuid in self._pending:
+            self._coalesce(call_uuid, message, frame)
+            return
+
+        if len(self._pending) >= self.max_pending:
+            raise ClientQueueFull(f"{len(self._pending)} messages pending")
+
+        key = call_uuid if call_uuid is not None else ('seq', next(self._sequence))
+        self._pending[key] = (message, frame)
+        self._ready.set()
+
+    def _coalesce(self, call_uuid: str, message: Dict[str, Any], frame: Frame):
+        pending_message, _ = self._pending[call_uuid]
+        self.coalesced += 1
+
+        if pending_message['type'] == 'call_created':
+            if message['type'] == 'call_ended':
+                # The client never saw this call, so it never needs to
+                del self._pending[call_uuid]
+                return
+            # The client still has to learn the call exists, with its latest state
+            message = dict(message, type='call_created')
+            frame = self.encode(message)
+
+        # The merged message carries the newer seq, so it moves behind
+        # everything queued before that seq to keep delivery in seq order
+        self._pending[call_uuid] = (message, frame)
+        self._pending.move_to_end(call_uuid)
+
+    @staticmethod
+    def coalesce_key(message: Dict[str, Any]) -> Optional[str]:
+        """Call uuid of call_* updates; other messages are never merged"""
+        if not message.get('type', '').startswith('call_'):
+            return None
+        data = message.get('data')
+        return data.get('uuid') if isinstance(data, dict) else None
+
+    async def next_frame(self) -> Frame:
+        while not self._pending:
+            self._ready.clear()
+            await self._ready.wait()
+        _, (_, frame) = self._pending.popitem(last=False)
+        return frame
+
+
 class WebSocketManager:
-    def __init__(self):
-        self.active_connections: Set[WebSocket] = set()
+    def __init__(self, send_timeout: float = 5.0, client_queue_size: int = 256):
+        self.clients: Dict[WebSocket, WebSocketClient] = {}
         self.user_connections: Dict[str, WebSocket] = {}
-        
-    async def connect(self, websocket: WebSocket, user_id: str = None):
+        # topic -> clients subscribed to it
+        self.topic_clients: Dict[str, Set[WebSocketClient]] = {}
+        self.send_timeout = send_timeout
+        self.client_queue_size = client_queue_size
+
+    @property
+    def active_connections(self) -> Set[WebSocket]:
+        return set(self.clients)
+
+    @property
+    def encodings(self) -> List[str]:
+        """Wire encodings this server can speak"""
+        return list(ENCODERS)
+
+    async def connect(self, websocket: WebSocket, user_id: str = None, encoding: str = 'json'):
         """Accept websocket connection"""
+        if encoding not in ENCODERS:
+            raise ValueError(f"Unsupported WebSocket encoding '{encoding}'")
         await websocket.accept()
-        self.active_connections.add(websocket)
-        
+        client = WebSocketClient(websocket, user_id, max_pending=self.client_queue_size, encoding=encoding)
+        client.writer_task = asyncio.create_task(self._writer(client))
+        self.clients[websocket] = client
+        self._index_topics(client)
+
         if user_id:
             self.user_connections[user_id] = websocket
-            
-        logger.info(f"WebSocket connected. Total connections: {len(self.active_connections)}")
-        
+
+        logger.info(f"WebSocket connected. Total connections: {len(self.clients)}")
+
     def disconnect(self, websocket: WebSocket, user_id: str = None):
         """Remove websocket connection"""
-        self.active_connections.discard(websocket)
-        
-        if user_id and user_id in self.user_connections:
+        client = self.clients.pop(websocket, None)
+        if not client:
+            return
+        if client.writer_task and client.writer_task is not asyncio.current_task():
+            client.writer_task.cancel()
+        self._unindex_topics(client)
+
+        user_id = client.user_id or user_id
+        if user_id and self.user_connections.get(user_id) is websocket:
             del self.user_connections[user_id]
-            
-        logger.info(f"WebSocket disconnected. Total connections: {len(self.active_connections)}")
-        
+
+        logger.info(f"WebSocket disconnected. Total connections: {len(self.clients)}")
+
+    def subscribe(self, websocket: WebSocket, topics: Iterable[str]) -> Set[str]:
+        """Replace the topics a connection receives events for"""
+        topics = {validate_topic(topic) for topic in topics}
+        client = self.clients.get(websocket)
+        if client:
+            self._unindex_topics(client)
+            client.topics = topics
+            self._index_topics(client)
+        return topics
+
+    def subscriptions(self, websocket: WebSocket) -> Set[str]:
+        client = self.clients.get(websocket)
+        return set(client.topics) if client else set()
+
+    async def send(self, websocket: WebSocket, message: dict):
+        """Queue a message for one connection, behind anything already queued for it"""
+        client = self.clients.get(websocket)
+        if client:
+            self._enqueue(client, message, client.encode(message))
+
     async def send_personal_message(self, message: dict, user_id: str):
         """Send message to specific user"""
-        if user_id in self.user_connections:
-            websocket = self.user_connections[user_id]
-            try:
-                await websocket.send_text(json.dumps(message))
-            except Exception as e:
-                logger.error(f"Error sending personal message: {e}")
-                self.disconnect(websocket, user_id)
-                
-    async def broadcast(self, message: dict):
-        """Broadcast message to all connected clients"""
-        if not self.active_connections:
+        websocket = self.user_connections.get(user_id)
+        if websocket:
+            await self.send(websocket, message)
+
+    async def broadcast(self, message: dict, topics: Optional[Iterable[str]] = None):
+        """Send message to the clients subscribed to any of topics (or to everyone)"""
+        recipients = self._recipients(topics)
+        if not recipients:
             return
-            
-        disconnected = set()
-        
-        for connection in self.active_connections.copy():
+
+        # Encode once per encoding in use; each client's writer task does the
+        # actual sending, so a slow client only ever delays itself
+        frames: Dict[str, Frame] = {}
+        for client in recipients:
+            frame = frames.get(client.encoding)
+            if frame is None:
+                frame = frames[client.encoding] = client.encode(message)
+            self._enqueue(client, message, frame)
+
+    def decode(self, received: Dict[str, Any]) -> Dict[str, Any]:
+        """Decode an ASGI websocket.receive message sent in the client's encoding"""
+        if received.get('bytes') is not None:
+            if not msgpack:
+                raise ValueError("Binary frames need the msgpack package")
+            return msgpack.unpackb(received['bytes'], raw=False)
+        return json.loads(received.get('text') or '')
+
+    def _recipients(self, topics: Optional[Iterable[str]]) -> Set[WebSocketClient]:
+        if topics is None:
+            return set(self.clients.values())
+        recipients = set(self.topic_clients.get(ALL_TOPIC, ()))
+        for topic in topics:
+            recipients.update(self.topic_clients.get(topic, ()))
+        return recipients
+
+    def _index_topics(self, client: WebSocketClient):
+        for topic in client.topics:
+            self.topic_clients.setdefault(topic, set()).add(client)
+
+    def _unindex_topics(self, client: WebSocketClient):
+        for topic in client.topics:
+            clients = self.topic_clients.get(topic)
+            if clients is not None:
+                clients.discard(client)
+                if not clients:
+                    del self.topic_clients[topic]
+
+    def stats(self) -> Dict[str, Any]:
+        pending = [client.pending for client in self.clients.values()]
+        return {
+            'connections': len(pending),
+            'topics': len(self.topic_clients),
+            'pending_messages': sum(pending),
+            'max_pending': max(pending, default=0),
+            'coalesced': sum(client.coalesced for client in self.clients.values()),
+            'encodings': {
+                encoding: sum(client.encoding == encoding for client in self.clients.values())
+                for encoding in ENCODERS
+            }
+        }
+
+    def _enqueue(self, client: WebSocketClient, message: dict, frame: Frame):
+        try:
+            client.enqueue(message, frame)
+        except ClientQueueFull as e:
+            logger.warning(f"Dropping WebSocket client that fell behind: {e}")
+            self._evict(client.websocket)
+
+    async def _writer(self, client: WebSocketClient):
+        """Drain one client's queue in order, dropping the client on failure"""
+        while True:
+            frame = await client.next_frame()
+            if isinstance(frame, bytes):
+                send = client.websocket.send_bytes(frame)
+            else:
+                send = client.websocket.send_text(frame)
             try:
-                await connection.send_text(json.dumps(message))
+                await asyncio.wait_for(send, timeout=self.send_timeout)
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                logger.warning(f"WebSocket send timed out after {self.send_timeout}s")
+                self._evict(client.websocket)
+                return
             except Exception as e:
-                logger.error(f"Error broadcasting message: {e}")
-                disconnected.add(connection)
-                
-        # Remove disconnected connections
-        for connection in disconnected:
-            self.active_connections.discard(connection)
-            # Also remove from user connections
-            for user_id, ws in list(self.user_connections.items()):
-                if ws == connection:
-                    del self.user_connections[user_id]
-                    break
\ No newline at end of file
+                logger.error(f"Error sending WebSocket message: {e}")
+                self._evict(client.websocket)
+                return
+
+    def _evict(self, websocket: WebSocket):
+        """Drop a client that cannot keep up and close its socket"""
+        self.disconnect(websocket)
+        asyncio.create_task(self._close(websocket))
+
+    @staticmethod
+    async def _close(websocket: WebSocket):
+        try:
+            await websocket.close(code=1013)
+        except Exception:
+            pass
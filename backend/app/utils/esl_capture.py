@@ -0,0 +1,53 @@
+import logging
+import time
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ESLCaptureWriter:
+    """Append-only recorder for raw ESL frames
+
+    Each record is a "<unix timestamp> <length>" line followed by exactly
+    <length> bytes of the frame as it was read from the socket and a newline.
+    """
+
+    def __init__(self, path: str, flush_every: int = 100):
+        self.path = path
+        self.flush_every = flush_every
+        self.frames = 0
+        self._file: Optional[BinaryIO] = open(path, "ab")
+
+    def record(self, raw: bytes, timestamp: Optional[float] = None):
+        if not self._file:
+            return
+        if timestamp is None:
+            timestamp = time.time()
+        self._file.write(b"%.6f %d\n" % (timestamp, len(raw)))
+        self._file.write(raw)
+        self._file.write(b"\n")
+        self.frames += 1
+        if self.frames % self.flush_every == 0:
+            self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+            logger.info(f"ESL capture {self.path} closed after {self.frames} frames")
+
+
+def read_capture(path: str) -> Iterator[Tuple[float, bytes]]:
+    """Yield (timestamp, raw frame) records from a capture file"""
+    with open(path, "rb") as capture:
+        while True:
+            header = capture.readline()
+            if not header:
+                return
+            timestamp, length = header.split()
+            raw = capture.read(int(length))
+            if len(raw) < int(length):
+                logger.warning(f"Truncated record at the end of {path}")
+                return
+            capture.read(1)
+            yield float(timestamp), raw
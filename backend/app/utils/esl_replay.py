@@ -0,0 +1,214 @@
+"""Fake FreeSWITCH event socket that replays a capture made by ESLClient
+
+    python -m app.utils.esl_replay capture.esl --port 8021 --speed 10
+
+Point the backend at it with ESL_TRANSPORT=direct, FREESWITCH_HOST=127.0.0.1
+and FREESWITCH_ESL_PORT=<port> to run the whole ESLClient -> CallManager ->
+WebSocketManager pipeline against recorded traffic.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from app.services.esl_protocol import encode_frame, parse_headers
+from app.utils.esl_capture import read_capture
+
+logger = logging.getLogger(__name__)
+
+# Events that change what 'show channels' reports
+CHANNEL_EVENTS = ('CHANNEL_CREATE', 'CHANNEL_ANSWER', 'CHANNEL_PARK', 'CHANNEL_HANGUP')
+
+
+class ESLReplayServer:
+    """Answers auth, events, filter, api and bgapi, and replays captured events
+
+    speed is a multiplier of the recorded pacing; 0 replays as fast as the
+    client reads. 'show channels as json' lists the channels the replay has
+    created and not yet hung up, so a client's resync agrees with the events
+    it has been sent.
+    """
+
+    def __init__(self, capture_path: str, password: str = "ClueCon", speed: float = 1.0,
+                 loop: bool = False):
+        self.password = password
+        self.speed = speed
+        self.loop = loop
+        self.events: List[Tuple[float, bytes, Optional[Dict[str, Any]]]] = [
+            (timestamp, raw, self._channel_event(raw)) for timestamp, raw in read_capture(capture_path)
+            if b"text/event-json" in raw.split(b"\n\n", 1)[0]
+        ]
+        # uuid -> 'show channels' row of every channel replayed and still up
+        self.channels: Dict[str, Dict[str, Any]] = {}
+        self.subscribers: List[asyncio.StreamWriter] = []
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8021) -> int:
+        self.server = await asyncio.start_server(self._handle, host, port)
+        port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"Replaying {len(self.events)} events on {host}:{port} at speed {self.speed or 'max'}")
+        return port
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        writer.write(encode_frame({"Content-Type": "auth/request"}))
+        authenticated = False
+        replay_task: Optional[asyncio.Task] = None
+
+        try:
+            while True:
+                block = await reader.readuntil(b"\n\n")
+                lines = block.decode().strip().split("\n")
+                command, headers = lines[0], parse_headers("\n".join(lines[1:]).encode())
+
+                if command.startswith("auth "):
+                    authenticated = command[5:] == self.password
+                    self._reply(writer, "+OK accepted" if authenticated else "-ERR invalid")
+                elif not authenticated:
+                    self._reply(writer, "-ERR command not found")
+                elif command.startswith("events "):
+                    self._reply(writer, "+OK event listener enabled json")
+                    if writer not in self.subscribers:
+                        self.subscribers.append(writer)
+                        replay_task = asyncio.create_task(self._replay(writer))
+                elif command.startswith("filter "):
+                    self._reply(writer, f"+OK filter {'deleted' if ' delete ' in command else 'added'}")
+                elif command.startswith("api "):
+                    body = self._api_response(command[4:])
+                    writer.write(encode_frame({"Content-Type": "api/response"}, body))
+                elif command.startswith("bgapi "):
+                    job_uuid = headers.get("Job-UUID", "")
+                    self._reply(writer, f"+OK Job-UUID: {job_uuid}", {"Job-UUID": job_uuid})
+                    self._publish_background_job(job_uuid, command[6:])
+                elif command == "exit":
+                    self._reply(writer, "+OK bye")
+                    break
+                else:
+                    self._reply(writer, "-ERR command not found")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if replay_task:
+                replay_task.cancel()
+            if writer in self.subscribers:
+                self.subscribers.remove(writer)
+            writer.close()
+
+    @staticmethod
+    def _reply(writer: asyncio.StreamWriter, text: str, extra: Optional[Dict[str, str]] = None):
+        headers = {"Content-Type": "command/reply", "Reply-Text": text}
+        headers.update(extra or {})
+        writer.write(encode_frame(headers))
+
+    def _api_response(self, command: str) -> bytes:
+        """Canned api replies; other state queries see an idle switch"""
+        if command.strip() == "show channels as json":
+            rows = list(self.channels.values())
+            return json.dumps({"row_count": len(rows), "rows": rows}).encode()
+        if command.startswith("show ") and command.endswith(" as json"):
+            return json.dumps({"row_count": 0}).encode()
+        return b"+OK\n"
+
+    @staticmethod
+    def _channel_event(raw: bytes) -> Optional[Dict[str, Any]]:
+        """The JSON body of a captured channel event, parsed once up front"""
+        try:
+            event = json.loads(raw.split(b"\n\n", 1)[1])
+        except (IndexError, ValueError):
+            return None
+        return event if event.get("Event-Name") in CHANNEL_EVENTS else None
+
+    def _track_channel(self, event: Dict[str, Any]):
+        """Apply a replayed channel event to the rows 'show channels' returns"""
+        call_uuid = event.get("Unique-ID")
+        name = event["Event-Name"]
+        if name == "CHANNEL_CREATE":
+            timestamp = event.get("Event-Date-Timestamp")
+            self.channels[call_uuid] = {
+                "uuid": call_uuid,
+                "direction": event.get("Call-Direction"),
+                "cid_num": event.get("Caller-Caller-ID-Number"),
+                "cid_name": event.get("Caller-Caller-ID-Name"),
+                "dest": event.get("Caller-Destination-Number"),
+                "callstate": "RINGING",
+                "created_epoch": str(int(timestamp) // 1000000) if timestamp else "",
+            }
+        elif name == "CHANNEL_HANGUP":
+            self.channels.pop(call_uuid, None)
+        elif call_uuid in self.channels:
+            row = self.channels[call_uuid]
+            if name == "CHANNEL_ANSWER":
+                row["callstate"] = "ACTIVE"
+            else:
+                row["application"] = "park"
+                row["application_data"] = event.get("variable_park_orbit") or ""
+
+    def _publish_background_job(self, job_uuid: str, command: str):
+        body = json.dumps({
+            "Event-Name": "BACKGROUND_JOB",
+            "Job-UUID": job_uuid,
+            "Job-Command": quote(command),
+            "_body": "+OK\n",
+        }).encode()
+        frame = encode_frame({"Content-Type": "text/event-json"}, body)
+        for subscriber in self.subscribers:
+            subscriber.write(frame)
+
+    async def _replay(self, writer: asyncio.StreamWriter):
+        """Send the captured events, paced by their recorded timestamps"""
+        while True:
+            started = time.monotonic()
+            first = self.events[0][0] if self.events else 0.0
+            for timestamp, raw, channel_event in self.events:
+                if self.speed:
+                    delay = (timestamp - first) / self.speed - (time.monotonic() - started)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                if channel_event:
+                    self._track_channel(channel_event)
+                writer.write(raw)
+                await writer.drain()
+
+            elapsed = time.monotonic() - started
+            rate = len(self.events) / elapsed if elapsed else 0.0
+            logger.info(f"Replayed {len(self.events)} events in {elapsed:.2f}s ({rate:.0f} events/s)")
+            if not self.loop:
+                return
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay an ESL capture as a fake FreeSWITCH")
+    parser.add_argument("capture", help="capture file written with ESL_CAPTURE_PATH")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8021)
+    parser.add_argument("--password", default="ClueCon")
+    parser.add_argument("--speed", default="1",
+                        help="pacing multiplier (1, 10, ...) or 'max' for as fast as possible")
+    parser.add_argument("--loop", action="store_true", help="restart the capture when it ends")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    speed = 0.0 if args.speed == "max" else float(args.speed)
+    server = ESLReplayServer(args.capture, password=args.password, speed=speed, loop=args.loop)
+
+    async def serve():
+        await server.start(args.host, args.port)
+        await server.server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
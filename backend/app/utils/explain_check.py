@@ -0,0 +1,103 @@
+"""Check that the hot call queries are planned with the indexes made for them
+
+    python -m app.utils.explain_check
+
+Runs EXPLAIN against DATABASE_URL (SQLite or PostgreSQL) for each statement
+built in app.services.call_queries and exits with status 1 when a plan does
+not use the index it was written for. Run it after migrating
+(alembic upgrade head) and after changing a query or an index.
+"""
+import asyncio
+import logging
+import sys
+from datetime import datetime
+from typing import List, Sequence, Tuple
+from sqlalchemy import Select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
+
+from app.config import settings
+from app.models.user import Extension  # noqa: F401  (configures Call's relationships)
+from app.services.call_queries import export_query, history_query, live_calls_query
+
+logger = logging.getLogger(__name__)
+
+PAGE = 50
+
+# (name, statement, index names of which the plan must use at least one)
+CHECKS: List[Tuple[str, Select, Sequence[str]]] = [
+    ("history page", history_query().limit(PAGE), ["ix_calls_created_at_id"]),
+    ("history next page", history_query(after=(datetime(2026, 1, 1), "~")).limit(PAGE),
+     ["ix_calls_created_at_id"]),
+    ("history by extension", history_query(extension_id="~").limit(PAGE), ["ix_calls_extension_created"]),
+    ("history by state", history_query(state="ENDED").limit(PAGE), ["ix_calls_state_created"]),
+    ("history by number", history_query(number="1001").limit(PAGE),
+     ["ix_calls_caller_created", "ix_calls_destination_created"]),
+    ("live calls", live_calls_query(), ["ix_calls_live"]),
+    ("cdr export", export_query(since=datetime(2026, 9, 1), until=datetime(2026, 10, 1)),
+     ["ix_calls_created_at_id"]),
+]
+
+
+async def explain(connection: AsyncConnection, stmt: Select) -> str:
+    """The query plan of stmt as text"""
+    dialect = connection.dialect
+    compiled = stmt.compile(dialect=dialect)
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+
+    prefix = "EXPLAIN QUERY PLAN " if dialect.name == "sqlite" else "EXPLAIN "
+    result = await connection.exec_driver_sql(prefix + str(compiled), params)
+    # SQLite puts the step description in the last column, PostgreSQL has one column
+    return "\n".join(str(row[-1]) for row in result.all())
+
+
+async def index_names(connection: AsyncConnection, index: str) -> List[str]:
+    """index plus, on a partitioned calls table, the per-partition indexes attached to it"""
+    if connection.dialect.name != "postgresql":
+        return [index]
+    result = await connection.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:index)"
+    ), {"index": index})
+    return [index] + list(result.scalars())
+
+
+async def run_checks(database_url: str) -> bool:
+    engine = create_async_engine(database_url)
+    passed = True
+    try:
+        async with engine.connect() as connection:
+            if connection.dialect.name == "postgresql":
+                # A near-empty dev table would otherwise always be scanned; this
+                # asks whether the index *can* serve the query, not whether it
+                # is cheaper today
+                await connection.exec_driver_sql("SET enable_seqscan = off")
+
+            for name, stmt, indexes in CHECKS:
+                plan = await explain(connection, stmt)
+                used = []
+                for index in indexes:
+                    # Plans of a partitioned table name the partitions' indexes
+                    if any(name in plan for name in await index_names(connection, index)):
+                        used.append(index)
+                if used:
+                    print(f"ok    {name:<22} {', '.join(used)}")
+                else:
+                    passed = False
+                    print(f"FAIL  {name:<22} expected {' or '.join(indexes)}")
+                    print("      " + plan.replace("\n", "\n      "))
+    finally:
+        await engine.dispose()
+    return passed
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    database_url = sys.argv[1] if len(sys.argv) > 1 else settings.database_url
+    sys.exit(0 if asyncio.run(run_checks(database_url)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+from typing import Optional, Tuple
+import paramiko
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK = 65536
+
+
+class ChannelStreamWriter:
+    """asyncio StreamWriter look-alike that writes to a paramiko channel"""
+
+    def __init__(self, channel: paramiko.Channel, on_close=None):
+        self.channel = channel
+        self._buffer = bytearray()
+        self._lock = asyncio.Lock()
+        self._on_close = on_close
+        self._closing = False
+
+    def write(self, data: bytes):
+        self._buffer += data
+
+    async def drain(self):
+        """Push buffered bytes into the channel, yielding while its window is full"""
+        async with self._lock:
+            while self._buffer:
+                if self.channel.closed:
+                    raise ConnectionResetError("SSH channel closed")
+                if not self.channel.send_ready():
+                    await asyncio.sleep(0.005)
+                    continue
+                sent = self.channel.send(bytes(self._buffer))
+                del self._buffer[:sent]
+
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        if self._on_close:
+            self._on_close()
+        self.channel.close()
+
+    async def wait_closed(self):
+        return None
+
+
+async def open_channel_streams(transport: paramiko.Transport, remote_host: str, remote_port: int,
+                               timeout: Optional[float] = 10.0
+                               ) -> Tuple[asyncio.StreamReader, ChannelStreamWriter]:
+    """Open a direct-tcpip channel and expose it as an asyncio stream pair
+
+    Reads are driven by the event loop watching the channel's notification
+    pipe, so no forwarding threads or loopback sockets are involved.
+    """
+    loop = asyncio.get_running_loop()
+    channel = await loop.run_in_executor(
+        None,
+        lambda: transport.open_channel(
+            'direct-tcpip', (remote_host, remote_port), ('localhost', 0), timeout=timeout
+        )
+    )
+    channel.setblocking(False)
+
+    reader = asyncio.StreamReader(limit=2 ** 20)
+    fd = channel.fileno()
+    state = {'paused': False, 'done': False}
+
+    def on_readable():
+        try:
+            while not state['paused'] and channel.recv_ready():
+                reader.feed_data(channel.recv(READ_CHUNK))
+        except Exception as e:
+            logger.warning(f"SSH channel read failed: {e}")
+            stop_reading()
+            return
+        # Anything still buffered (we may be paused) is read before the EOF
+        if (channel.eof_received or channel.closed) and not channel.recv_ready():
+            stop_reading()
+
+    def stop_reading():
+        state['done'] = True
+        loop.remove_reader(fd)
+        if not reader.at_eof():
+            reader.feed_eof()
+
+    reader.set_transport(_ChannelReadControl(loop, fd, on_readable, state))
+    loop.add_reader(fd, on_readable)
+    return reader, ChannelStreamWriter(channel, on_close=stop_reading)
+
+
+class _ChannelReadControl:
+    """Flow control the StreamReader applies to its transport, for a channel
+
+    The reader calls pause_reading() once more than twice its limit is
+    buffered and resume_reading() when it has drained below the limit. While
+    paused the channel is not read, so paramiko stops extending the SSH
+    window and the sender is throttled, as a paused TCP transport would be.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, fd: int, on_readable, state: dict):
+        self._loop = loop
+        self._fd = fd
+        self._on_readable = on_readable
+        self._state = state
+
+    def pause_reading(self):
+        self._state['paused'] = True
+        self._loop.remove_reader(self._fd)
+
+    def resume_reading(self):
+        if not self._state['paused']:
+            return
+        self._state['paused'] = False
+        if not self._state['done']:
+            self._loop.add_reader(self._fd, self._on_readable)
+            # Data that arrived while paused is read without waiting for a new wakeup
+            self._loop.call_soon(self._on_readable)
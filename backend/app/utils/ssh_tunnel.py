@@ -1,32 +1,230 @@
 import asyncio
 import paramiko
+import selectors
 import socket
 import threading
 import logging
-from typing import Optional
+import time
+from typing import Any, Dict, List, Optional
+from app.utils.ssh_channel import open_channel_streams
 
 logger = logging.getLogger(__name__)
 
 
+class TunnelStats:
+    """Byte and forwarding latency counters shared by all connections of a tunnel"""
+
+    def __init__(self):
+        self.connections = 0
+        self.active_connections = 0
+        self.bytes_up = 0
+        self.bytes_down = 0
+        self.latency_samples = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        
+    def record_latency(self, seconds: float):
+        self.latency_samples += 1
+        self.latency_total += seconds
+        self.latency_max = max(self.latency_max, seconds)
+        
+    def as_dict(self) -> Dict[str, Any]:
+        average = self.latency_total / self.latency_samples if self.latency_samples else 0.0
+        return {
+            'connections': self.connections,
+            'active_connections': self.active_connections,
+            'bytes_up': self.bytes_up,
+            'bytes_down': self.bytes_down,
+            'forward_latency_avg_ms': round(average * 1000, 3),
+            'forward_latency_max_ms': round(self.latency_max * 1000, 3),
+        }
+
+
+class _ForwardedConnection:
+    """One local client socket spliced to one SSH direct-tcpip channel
+
+    Each direction has its own buffer; bytes stay buffered until the peer
+    accepts them, and EOF on one side is passed on as a half-close once
+    that direction's buffer has drained.
+    """
+
+    def __init__(self, client: socket.socket, channel: paramiko.Channel,
+                 stats: TunnelStats, buffer_size: int):
+        self.client = client
+        self.channel = channel
+        self.stats = stats
+        self.buffer_size = buffer_size
+        self.max_buffered = buffer_size * 4
+        self.up = bytearray()      # client -> channel
+        self.down = bytearray()    # channel -> client
+        self.up_since: Optional[float] = None
+        self.down_since: Optional[float] = None
+        self.client_eof = False
+        self.channel_eof = False
+        self.up_shut = False
+        self.down_shut = False
+        self.closed = False
+        self.client.setblocking(False)
+        self.channel.setblocking(False)
+        
+    @property
+    def done(self) -> bool:
+        return self.closed or (self.up_shut and self.down_shut)
+        
+    def client_interest(self) -> int:
+        events = 0
+        if not self.client_eof and len(self.up) < self.max_buffered:
+            events |= selectors.EVENT_READ
+        if self.down:
+            events |= selectors.EVENT_WRITE
+        return events
+        
+    def channel_interest(self) -> int:
+        # A channel's fileno only signals readability; writes are polled
+        if not self.channel_eof and len(self.down) < self.max_buffered:
+            return selectors.EVENT_READ
+        return 0
+        
+    def read_client(self):
+        try:
+            data = self.client.recv(self.buffer_size)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.client_eof = True
+            return
+        if not self.up:
+            self.up_since = time.monotonic()
+        self.up += data
+        self.stats.bytes_up += len(data)
+        
+    def read_channel(self):
+        try:
+            data = self.channel.recv(self.buffer_size)
+        except socket.timeout:
+            return
+        if not data:
+            self.channel_eof = True
+            return
+        if not self.down:
+            self.down_since = time.monotonic()
+        self.down += data
+        self.stats.bytes_down += len(data)
+        
+    def write_client(self):
+        if not self.down:
+            return
+        try:
+            sent = self.client.send(self.down)
+        except BlockingIOError:
+            return
+        except OSError:
+            self.close()
+            return
+        del self.down[:sent]
+        if not self.down:
+            self.stats.record_latency(time.monotonic() - self.down_since)
+            self.down_since = None
+            
+    def write_channel(self):
+        while self.up and self.channel.send_ready():
+            try:
+                sent = self.channel.send(self.up)
+            except socket.timeout:
+                break
+            except Exception:
+                self.close()
+                return
+            del self.up[:sent]
+        if not self.up and self.up_since is not None:
+            self.stats.record_latency(time.monotonic() - self.up_since)
+            self.up_since = None
+            
+    @property
+    def channel_write_blocked(self) -> bool:
+        return bool(self.up) and not self.channel.send_ready()
+        
+    def propagate_eof(self):
+        """Half-close the far side of any direction whose source hit EOF and drained"""
+        if self.client_eof and not self.up and not self.up_shut:
+            try:
+                self.channel.shutdown_write()
+            except Exception:
+                pass
+            self.up_shut = True
+        if self.channel_eof and not self.down and not self.down_shut:
+            try:
+                self.client.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+            self.down_shut = True
+        if self.down_shut and self.channel.closed and not self.up_shut:
+            # The remote end is gone entirely, nothing more can be sent to it
+            self.up.clear()
+            self.up_shut = True
+            
+    def close(self):
+        """Mark the connection dead; the forwarder releases it after unregistering"""
+        self.closed = True
+        
+    def release(self):
+        for endpoint in (self.client, self.channel):
+            try:
+                endpoint.close()
+            except Exception:
+                pass
+
+
 class SSHTunnel:
     def __init__(self, ssh_host: str, ssh_username: str, ssh_key_path: str, 
-                 remote_host: str, remote_port: int):
+                 remote_host: str, remote_port: int, buffer_size: int = 262144):
         self.ssh_host = ssh_host
         self.ssh_username = ssh_username
         self.ssh_key_path = ssh_key_path
         self.remote_host = remote_host
         self.remote_port = remote_port
+        self.buffer_size = buffer_size
         self.local_port: Optional[int] = None
         self.ssh_client: Optional[paramiko.SSHClient] = None
         self.tunnel_thread: Optional[threading.Thread] = None
         self.server_socket: Optional[socket.socket] = None
         self.running = False
+        self.stats = TunnelStats()
         
     async def start(self) -> int:
         """Start SSH tunnel and return local port"""
-        # Find available local port
-        self.local_port = self._find_free_port()
+        await self.connect()
+        
+        # Bind before returning so the port accepts connections immediately
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind(('localhost', 0))
+        self.server_socket.listen(5)
+        self.server_socket.setblocking(False)
+        self.local_port = self.server_socket.getsockname()[1]
         
+        # Start tunnel in separate thread
+        self.running = True
+        self.tunnel_thread = threading.Thread(target=self._tunnel_worker)
+        self.tunnel_thread.daemon = True
+        self.tunnel_thread.start()
+        
+        return self.local_port
+        
+    async def connect(self):
+        """Open the SSH connection without any local listener"""
+        await asyncio.get_running_loop().run_in_executor(None, self._connect_ssh)
+        
+    async def open_stream(self):
+        """Open a direct-tcpip channel to the remote port as an asyncio stream pair"""
+        return await open_channel_streams(
+            self.ssh_client.get_transport(), self.remote_host, self.remote_port
+        )
+        
+    def _connect_ssh(self):
+        """Connect and authenticate the SSH client (blocking)"""
         # Create SSH client
         self.ssh_client = paramiko.SSHClient()
         self.ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
@@ -67,80 +265,112 @@ class SSHTunnel:
                 timeout=10
             )
         
-        # Start tunnel in separate thread
-        self.running = True
-        self.tunnel_thread = threading.Thread(target=self._tunnel_worker)
-        self.tunnel_thread.daemon = True
-        self.tunnel_thread.start()
-        
-        return self.local_port
-        
     async def stop(self):
         """Stop SSH tunnel"""
         self.running = False
         
+        if self.tunnel_thread:
+            await asyncio.get_running_loop().run_in_executor(None, self.tunnel_thread.join, 5)
+            self.tunnel_thread = None
+            
         if self.server_socket:
             self.server_socket.close()
             
         if self.ssh_client:
             self.ssh_client.close()
             
-        if self.tunnel_thread:
-            self.tunnel_thread.join(timeout=5)
-            
-    def _find_free_port(self) -> int:
-        """Find a free local port"""
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.bind(('', 0))
-            s.listen(1)
-            port = s.getsockname()[1]
-        return port
-        
     def _tunnel_worker(self):
-        """Worker thread for SSH tunnel"""
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.server_socket.bind(('localhost', self.local_port))
-        self.server_socket.listen(5)
+        """Single selector loop that accepts clients and forwards all their traffic"""
+        selector = selectors.DefaultSelector()
+        selector.register(self.server_socket, selectors.EVENT_READ, None)
+        connections: List[_ForwardedConnection] = []
+        registered: Dict[Any, int] = {}
         
-        while self.running:
-            try:
-                client_socket, addr = self.server_socket.accept()
-                threading.Thread(
-                    target=self._handle_client,
-                    args=(client_socket,),
-                    daemon=True
-                ).start()
-            except Exception:
-                break
-                
-    def _handle_client(self, client_socket: socket.socket):
-        """Handle client connection through tunnel"""
         try:
-            # Create channel through SSH
+            while self.running:
+                # Channels cannot signal writability, so poll while one is full
+                blocked = any(c.channel_write_blocked for c in connections)
+                for key, mask in selector.select(timeout=0.01 if blocked else 0.5):
+                    if key.data is None:
+                        connection = self._accept(key.fileobj)
+                        if connection:
+                            connections.append(connection)
+                        continue
+                        
+                    connection, side = key.data
+                    if side == 'client':
+                        if mask & selectors.EVENT_READ:
+                            connection.read_client()
+                        if mask & selectors.EVENT_WRITE:
+                            connection.write_client()
+                    else:
+                        connection.read_channel()
+                        
+                for connection in connections:
+                    if not connection.closed:
+                        connection.write_channel()
+                        connection.write_client()
+                        connection.propagate_eof()
+                    self._update_registration(selector, registered, connection)
+                    
+                finished = [c for c in connections if c.done]
+                for connection in finished:
+                    connection.release()
+                    connections.remove(connection)
+                    self.stats.active_connections -= 1
+        except Exception as e:
+            if self.running:
+                logger.error(f"SSH tunnel forwarder stopped: {e}")
+        finally:
+            selector.close()
+            for connection in connections:
+                connection.release()
+            
+    def _accept(self, server_socket: socket.socket) -> Optional[_ForwardedConnection]:
+        """Accept a local client and open its SSH channel"""
+        try:
+            client_socket, addr = server_socket.accept()
+        except BlockingIOError:
+            return None
+            
+        try:
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             transport = self.ssh_client.get_transport()
-            remote_socket = transport.open_channel(
+            channel = transport.open_channel(
                 'direct-tcpip',
                 (self.remote_host, self.remote_port),
                 ('localhost', self.local_port)
             )
-            
-            # Forward data between client and remote
-            def forward(source, destination):
-                while True:
-                    try:
-                        data = source.recv(1024)
-                        if not data:
-                            break
-                        destination.send(data)
-                    except Exception:
-                        break
-                        
-            # Start forwarding in both directions
-            threading.Thread(target=forward, args=(client_socket, remote_socket), daemon=True).start()
-            threading.Thread(target=forward, args=(remote_socket, client_socket), daemon=True).start()
-            
         except Exception as e:
-            print(f"Error in tunnel client handler: {e}")
-        finally:
-            client_socket.close()
\ No newline at end of file
+            logger.error(f"Error opening SSH channel for tunnel client: {e}")
+            client_socket.close()
+            return None
+            
+        self.stats.connections += 1
+        self.stats.active_connections += 1
+        return _ForwardedConnection(client_socket, channel, self.stats, self.buffer_size)
+        
+    @staticmethod
+    def _update_registration(selector: selectors.BaseSelector, registered: Dict[Any, int],
+                             connection: _ForwardedConnection):
+        """Keep the selector interest of both endpoints in line with buffer state"""
+        endpoints = (
+            (connection.client, connection.client_interest(), 'client'),
+            (connection.channel, connection.channel_interest(), 'channel'),
+        )
+        for endpoint, events, side in endpoints:
+            if connection.done:
+                events = 0
+            current = registered.get(endpoint, 0)
+            if events == current:
+                continue
+            if current and events:
+                selector.modify(endpoint, events, (connection, side))
+            elif events:
+                selector.register(endpoint, events, (connection, side))
+            else:
+                selector.unregister(endpoint)
+            if events:
+                registered[endpoint] = events
+            else:
+                registered.pop(endpoint, None)
@@ -7,6 +7,9 @@ class CTIApp {
         this.currentCallUuid = null;
         this.reconnectAttempts = 0;
         this.maxReconnectAttempts = 5;
+        // Position in the backend's event stream, used to resume after a reconnect
+        this.epoch = null;
+        this.lastSeq = null;
         
         this.initializeApp();
     }
@@ -31,10 +34,17 @@ class CTIApp {
             this.updateConnectionStatus(true);
             this.reconnectAttempts = 0;
             
-            // Request initial data
-            this.sendWebSocketMessage({
-                type: 'get_active_calls'
-            });
+            // Catch up on what was missed, or request initial data
+            if (this.epoch !== null) {
+                this.sendWebSocketMessage({
+                    type: 'resume',
+                    data: { epoch: this.epoch, last_seq: this.lastSeq }
+                });
+            } else {
+                this.sendWebSocketMessage({
+                    type: 'get_active_calls'
+                });
+            }
         };
         
         this.ws.onmessage = (event) => {
@@ -77,11 +87,19 @@ class CTIApp {
     handleWebSocketMessage(message) {
         console.log('Received message:', message);
         
+        if (message.epoch !== undefined) {
+            this.epoch = message.epoch;
+        }
+        if (message.seq !== undefined) {
+            this.lastSeq = message.seq;
+        }
+        
         switch (message.type) {
             case 'call_created':
                 this.addCall(message.data);
                 break;
             case 'call_answered':
+            case 'call_updated':
                 this.updateCall(message.data);
                 break;
             case 'call_ended':
@@ -100,6 +118,9 @@ class CTIApp {
             case 'active_calls':
                 this.loadActiveCalls(message.data);
                 break;
+            case 'resumed':
+                message.data.events.forEach(event => this.handleWebSocketMessage(event));
+                break;
             case 'transfer_result':
             case 'park_result':
             case 'hangup_result':